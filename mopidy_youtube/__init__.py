@@ -20,6 +20,21 @@ class Extension(ext.Extension):
     def get_config_schema(self):
         schema = super().get_config_schema()
         schema["allow_cache"] = config.String(optional=True)
+        schema["cache_max_size"] = config.Integer(optional=True, minimum=1)
+        schema["cache_metadata"] = config.Boolean(optional=True)
+        schema["entry_cache_size"] = config.Integer(optional=True, minimum=1)
+        schema["entry_cache_ttl"] = config.Integer(optional=True, minimum=1)
+        schema["browse_cache_size"] = config.Integer(optional=True, minimum=1)
+        schema["browse_cache_ttl"] = config.Integer(optional=True, minimum=1)
+        schema["browse_cache_soft_ttl"] = config.Integer(optional=True, minimum=1)
+        schema["http_cache"] = config.Boolean(optional=True)
+        schema["http2"] = config.Boolean(optional=True)
+        schema["background_workers"] = config.Integer(optional=True, minimum=1)
+        schema["load_workers"] = config.Integer(optional=True, minimum=1)
+        schema["request_workers"] = config.Integer(optional=True, minimum=1)
+        schema["download_workers"] = config.Integer(optional=True, minimum=1)
+        schema["download_ratelimit"] = config.Integer(optional=True, minimum=1)
+        schema["resolver_processes"] = config.Integer(optional=True, minimum=0)
         schema["youtube_api_key"] = config.String(optional=True)
         schema["search_results"] = config.Integer(minimum=1)
         schema["playlist_max_videos"] = config.Integer(minimum=1)
@@ -45,7 +60,7 @@ class Extension(ext.Extension):
         registry.add("http:app", {"name": self.ext_name, "factory": self.webapp})
 
     def webapp(self, config, core):
-        from .web import AudioHandler, ImageHandler, IndexHandler
+        from .web import AudioHandler, ImageHandler, IndexHandler, StatsHandler
 
         cache_dir = self.get_cache_dir(config)
 
@@ -55,6 +70,7 @@ class Extension(ext.Extension):
                 IndexHandler,
                 {"root": cache_dir, "core": core, "config": config},
             ),
+            (r"/stats.json", StatsHandler),
             (r"/(.*\.(?:jpg|webp))", ImageHandler, {"path": cache_dir}),
             (r"/(.*\.(?:webm|m4a|mp3|ogg))", AudioHandler, {"cache_dir": cache_dir}),
         ]
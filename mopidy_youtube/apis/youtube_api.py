@@ -1,4 +1,8 @@
+import json
+import threading
+
 from mopidy_youtube import logger
+from mopidy_youtube.cachestats import StatsTTLCache
 from mopidy_youtube.comms import Client
 from mopidy_youtube.youtube import Video
 
@@ -12,6 +16,40 @@ class API(Client):
     youtube_api_key = None
     endpoint = "https://www.googleapis.com/youtube/v3/"
 
+    # the last response to each list request, with its ETag, so that asking
+    # again can be answered with 304 Not Modified. Its hits are the requests
+    # answered that way, its misses those that returned a (new) response
+    etag_cache = StatsTTLCache("etags", maxsize=1000, ttl=86400)
+    etag_cache_lock = threading.Lock()
+
+    @classmethod
+    def _get_conditional(cls, resource, query):
+        """
+        gets 'resource' with If-None-Match, if it has been fetched before,
+        reusing the stored response if it hasn't changed
+        """
+        key = (resource, tuple(sorted((k, str(v)) for k, v in query.items())))
+        with cls.etag_cache_lock:
+            stored = cls.etag_cache[key] if key in cls.etag_cache else None
+
+        headers = {"If-None-Match": stored[0]} if stored else {}
+        result = cls.session.get(API.endpoint + resource, params=query, headers=headers)
+
+        if stored and result.status_code == 304:
+            with cls.etag_cache_lock:
+                cls.etag_cache.hits += 1
+                # keep it for another ttl
+                cls.etag_cache[key] = stored
+            logger.debug(f"youtube_api '{resource}' not modified")
+            return json.loads(stored[1])
+
+        with cls.etag_cache_lock:
+            cls.etag_cache.misses += 1
+            etag = result.headers.get("ETag")
+            if result.ok and etag:
+                cls.etag_cache[key] = (etag, result.text)
+        return result.json()
+
     @classmethod
     def search(cls, q):
         """
@@ -66,8 +104,7 @@ class API(Client):
             "key": cls.youtube_api_key,
         }
         logger.debug(f"youtube_api 'list_videos' triggered session.get: {ids}")
-        result = cls.session.get(API.endpoint + "videos", params=query)
-        return result.json()
+        return cls._get_conditional("videos", query)
 
     @classmethod
     def list_playlists(cls, ids):
@@ -84,8 +121,7 @@ class API(Client):
             "key": cls.youtube_api_key,
         }
         logger.debug(f"youtube_api 'list_playlists' triggered session.get: {ids}")
-        result = cls.session.get(API.endpoint + "playlists", params=query)
-        return result.json()
+        return cls._get_conditional("playlists", query)
 
     @classmethod
     def list_playlistitems(cls, id, page, max_results):
@@ -104,8 +140,7 @@ class API(Client):
             "pageToken": page,
         }
         logger.debug(f"youtube_api 'list_playlistitems' triggered session.get: {id}")
-        result = cls.session.get(API.endpoint + "playlistItems", params=query)
-        return result.json()
+        return cls._get_conditional("playlistItems", query)
 
     @classmethod
     def list_channelplaylists(cls, channel_id):
@@ -124,5 +159,4 @@ class API(Client):
         logger.debug(
             f"youtube_api 'list_channelplaylists' triggered session.get: {channel_id}"
         )
-        result = cls.session.get(API.endpoint + "playlists", params=query)
-        return result.json()
+        return cls._get_conditional("playlists", query)
@@ -1,10 +1,9 @@
 import json
 import re
-from concurrent.futures.thread import ThreadPoolExecutor
 from itertools import repeat
 from urllib.parse import urlencode, urljoin
 
-from mopidy_youtube import logger
+from mopidy_youtube import logger, workers
 from mopidy_youtube.apis.json_paths import (  # listChannelPlaylistsPath,
     continuationItemsPath,
     deep_search,
@@ -43,9 +42,8 @@ class jAPI(Client):
 
         result = []
 
-        with ThreadPoolExecutor() as executor:
-            futures = executor.map(cls.run_search, repeat(q), params)
-            [result.extend(value[: int(Video.search_results)]) for value in futures]
+        futures = workers.map("requests", cls.run_search, repeat(q), params)
+        [result.extend(value[: int(Video.search_results)]) for value in futures]
 
         return json.loads(
             json.dumps(
@@ -140,11 +138,10 @@ class jAPI(Client):
         if len(ids) == 1:
             items.extend(job(ids[0]))
         else:
-            with ThreadPoolExecutor() as executor:
-                # make sure order is deterministic so that HTTP requests
-                # are replayable in tests
-                for id in executor.map(job, ids):
-                    items.extend(id)
+            # make sure order is deterministic so that HTTP requests
+            # are replayable in tests
+            for id in workers.map("requests", job, ids):
+                items.extend(id)
 
         return json.loads(
             json.dumps(
@@ -241,11 +238,10 @@ class jAPI(Client):
         if len(ids) == 1:
             items.extend(job(ids[0]))
         else:
-            with ThreadPoolExecutor() as executor:
-                # make sure order is deterministic so that HTTP requests
-                # are replayable in tests
-                for id in executor.map(job, ids):
-                    items.extend(id)
+            # make sure order is deterministic so that HTTP requests
+            # are replayable in tests
+            for id in workers.map("requests", job, ids):
+                items.extend(id)
 
         return json.loads(json.dumps({"items": items}, sort_keys=False, indent=1))
 
@@ -1,12 +1,9 @@
 import json
-from concurrent.futures import as_completed
-from concurrent.futures.thread import ThreadPoolExecutor
 from itertools import repeat
 
-import pykka
 from ytmusicapi import YTMusic
 
-from mopidy_youtube import logger
+from mopidy_youtube import logger, workers
 from mopidy_youtube.apis import youtube_japi
 from mopidy_youtube.apis.json_paths import traverse, ytmErrorThumbnailPath
 from mopidy_youtube.apis.ytm_item_to_video import ytm_item_to_video
@@ -49,10 +46,10 @@ class Music(Client):
 
         search_functions = [cls.search_albums, cls.search_songs]
 
-        with ThreadPoolExecutor() as executor:
-            # is this the best way to make this deterministic (map + lambda)?
-            futures = executor.map(lambda x, y: x(y), search_functions, repeat(q))
-            [result.extend(value[: int(Video.search_results)]) for value in futures]
+        # is this the best way to make this deterministic (map + lambda)?
+        # each search fans out into requests of its own (see process_albums)
+        futures = workers.map("load", lambda x, y: x(y), search_functions, repeat(q))
+        [result.extend(value[: int(Video.search_results)]) for value in futures]
 
         return json.loads(json.dumps({"items": result}))
 
@@ -143,9 +140,9 @@ class Music(Client):
                     if "artists" in related_track:
                         item["artists"] = related_track["artists"]
 
-        with ThreadPoolExecutor() as executor:
-            executor.submit(cls.list_playlists(related_albums))
-            executor.shutdown(wait=False)
+        workers.submit(
+            "background", cls.list_playlists, related_albums, priority=workers.PREFETCH
+        )
 
         tracks = [
             ytm_item_to_video(track)
@@ -183,9 +180,8 @@ class Music(Client):
             f"youtube_music list_videos triggered ytmusic.get_song x {len(ids)}: {ids}"
         )
 
-        with ThreadPoolExecutor() as executor:
-            futures = executor.map(ytmusic.get_song, ids)
-            [results.append(value) for value in futures if value is not None]
+        futures = workers.map("requests", ytmusic.get_song, ids)
+        [results.append(value) for value in futures if value is not None]
 
         # deal with errors
         for result in results:
@@ -245,18 +241,17 @@ class Music(Client):
             f"_get_playlist_or_album x {len(ids)}: {ids}"
         )
 
-        with ThreadPoolExecutor() as executor:
-            futures = {
-                executor.submit(cls._get_playlist_or_album, id): id for id in ids
-            }
-            for future in as_completed(futures):
-                try:
-                    results.append(future.result())
-                except Exception as e:
-                    logger.error(
-                        f"youtube_music list_playlists "
-                        f"_get_playlist_or_album {e}, {futures[future]}"
-                    )
+        def job(id):
+            try:
+                return cls._get_playlist_or_album(id)
+            except Exception as e:
+                logger.error(
+                    f"youtube_music list_playlists _get_playlist_or_album {e}, {id}"
+                )
+
+        for result in workers.map("requests", job, ids):
+            if result is not None:
+                results.append(result)
 
         if len(results) == 0:
             # why would this happen?
@@ -458,21 +453,20 @@ class Music(Client):
                 f"youtube_music process_albums triggered "
                 f"ytmusic.get_album: {result['browseId']}"
             )
-            # ytmusic.get_album is necessary to get the number of tracks
-            ytmusic_album = ytmusic.get_album(result["browseId"])
-            ytmusic_album.update({"playlistId": result["browseId"]})
-            album = cls.yt_listitem_to_playlist(ytmusic_album)
-            return album
-
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(job, result): result for result in results}
-            for future in as_completed(futures):
-                try:
-                    albums.append(future.result())
-                except Exception as e:
-                    logger.error(
-                        f"youtube_music process_albums get_album error {e}, {futures[future]}"
-                    )
+            try:
+                # ytmusic.get_album is necessary to get the number of tracks
+                ytmusic_album = ytmusic.get_album(result["browseId"])
+                ytmusic_album.update({"playlistId": result["browseId"]})
+                album = cls.yt_listitem_to_playlist(ytmusic_album)
+                return album
+            except Exception as e:
+                logger.error(
+                    f"youtube_music process_albums get_album error {e}, {result}"
+                )
+
+        for album in workers.map("requests", job, results):
+            if album is not None:
+                albums.append(album)
 
         # given we're calling ytmusic.get_album, which returns tracks, we might
         # as well create the playlist objects and the related video objects.
@@ -583,8 +577,6 @@ class Music(Client):
             pl = Playlist.get(item["id"]["playlistId"])
             pl._set_api_data(["title", "video_count", "thumbnails", "channel"], item)
 
-            pl._videos = pykka.ThreadingFuture()
-
             for track in item["tracks"]:
                 if "album" not in track:
                     track.update(
@@ -609,6 +601,8 @@ class Music(Client):
                 video._set_api_data(fields, track)
                 plvideos.append(video)
 
-            pl._videos.set(
-                [x for _, x in zip(range(Playlist.playlist_max_videos), plvideos)]
+            pl._set_field(
+                "videos",
+                [x for _, x in zip(range(Playlist.playlist_max_videos), plvideos)],
+                replace=True,
             )
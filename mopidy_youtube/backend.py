@@ -1,13 +1,27 @@
 import json
-import os
+import pathlib
+import threading
+import time
 
 import pykka
-from cachetools import TTLCache, cached
 from mopidy import backend, httpclient, listener
 from mopidy.core import CoreListener
-from mopidy.models import Image, Ref, SearchResult, Track, model_json_decoder
-
-from mopidy_youtube import Extension, logger, youtube
+from mopidy.models import Ref, SearchResult, Track, model_json_decoder
+
+from mopidy_youtube import (
+    Extension,
+    cachedir,
+    cachestats,
+    comms,
+    downloads,
+    logger,
+    resolver,
+    storage,
+    thumbnails,
+    warmup,
+    workers,
+    youtube,
+)
 from mopidy_youtube.apis import youtube_japi
 from mopidy_youtube.converters import convert_playlist_to_album, convert_video_to_track
 from mopidy_youtube.data import (
@@ -34,10 +48,80 @@ background, so steps 2/3 are usually instantaneous.
 
 
 class YouTubeCoreListener(pykka.ThreadingActor, CoreListener):
+    # keep the stream urls of the current and this many following tracks
+    # from expiring, checking every refresh_interval seconds
+    refresh_tracks = 3
+    refresh_interval = 60
+
     def __init__(self, config, core):
         super().__init__()
         self.config = config
         self.core = core
+        self._refresh_wanted = threading.Event()
+        self._stopping = threading.Event()
+
+    def on_start(self):
+        threading.Thread(
+            target=self._refresh_audio_urls, name="YouTubeRefresher", daemon=True
+        ).start()
+
+    def on_stop(self):
+        self._stopping.set()
+        self._refresh_wanted.set()
+
+    def _refresh_audio_urls(self):
+        """
+        runs in the background, resolving the audio_url of upcoming tracks
+        again before it expires, so that translate_uri doesn't have to
+        """
+        while not self._stopping.is_set():
+            self._refresh_wanted.wait(timeout=self.refresh_interval)
+            self._refresh_wanted.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                playing, upcoming = self._upcoming_video_ids()
+                # only the track that is playing skips the download queue
+                # and its rate limit; the next ones are moved up it, but
+                # stay behind translate_uri
+                if playing:
+                    with workers.priority(workers.PLAYBACK):
+                        youtube.Video.get(playing).refresh_audio_url()
+                with workers.priority(workers.INTERACTIVE):
+                    for video_id in upcoming:
+                        youtube.Video.get(video_id).refresh_audio_url()
+            except Exception as e:
+                logger.error(f"error refreshing audio urls: {e}")
+
+    def _upcoming_video_ids(self):
+        """
+        returns the video id of the track that is playing (or None), and those
+        of the refresh_tracks tracks after it
+        """
+
+        def video_id(tl_track):
+            uri = tl_track.track.uri
+            if uri.startswith("youtube:video:") or uri.startswith("yt:video:"):
+                return extract_video_id(uri)
+            return None
+
+        tl_tracks = self.core.tracklist.get_tl_tracks().get()
+        current = self.core.playback.get_current_tl_track().get()
+        index = self.core.tracklist.index(current).get() if current else None
+        if index is None:
+            playing, start = None, 0
+        else:
+            playing, start = video_id(tl_tracks[index]), index + 1
+        upcoming = [
+            video_id(tl_track)
+            for tl_track in tl_tracks[start : start + self.refresh_tracks]
+        ]
+        return playing, [id for id in upcoming if id]
+
+    def track_playback_started(self, tl_track):
+        self._refresh_wanted.set()
+        if youtube.cache_index:
+            youtube.cache_index.touch(extract_video_id(tl_track.track.uri))
 
     def tracklist_changed(self):
         # We really only need an audio url for tracks that are going to be played
@@ -59,7 +143,33 @@ class YouTubeCoreListener(pykka.ThreadingActor, CoreListener):
             if track.uri.startswith("youtube:video:")
             or track.uri.startswith("yt:video:")
         ]
-        [youtube.Video.get(video_id).audio_url for video_id in video_ids]
+
+        # don't evict anything that is queued
+        if youtube.cache_index:
+            youtube.cache_index.protected = set(video_ids)
+
+        # tracks restored at startup are left to the warm-up, which resolves
+        # them a few at a time
+        warm_up = warmup.active
+        for video_id in video_ids:
+            if youtube.Video.dead_reason(video_id) or (
+                warm_up and warm_up.covers(video_id)
+            ):
+                continue
+            video = youtube.Video.get(video_id)
+            if video._audio_url is None:
+                # in the background, behind anything that is more urgent
+                workers.submit(
+                    "background",
+                    getattr,
+                    video,
+                    "audio_url",
+                    priority=workers.PREFETCH,
+                )
+
+        # and the current and next tracks ahead of the rest (see
+        # _refresh_audio_urls)
+        self._refresh_wanted.set()
 
     # used for add to playback history function
     # stolen from mopidy-ytmusic (https://github.com/OzymandiasTheGreat/mopidy-ytmusic/blob/master/mopidy_ytmusic/scrobble_fe.py)
@@ -124,6 +234,38 @@ class YouTubeBackend(
         youtube.Video.http_port = config["http"]["port"]
         youtube.Playlist.playlist_max_videos = config["youtube"]["playlist_max_videos"]
 
+        comms.Client.cache_responses = bool(config["youtube"].get("http_cache"))
+        comms.Client.http2 = bool(config["youtube"].get("http2"))
+        if comms.Client.http2 and not comms.http2_available():
+            logger.warning(
+                "http2 is enabled, but httpx[http2] is not installed; not using it"
+            )
+            comms.Client.http2 = False
+        workers.configure(
+            background=config["youtube"].get("background_workers"),
+            load=config["youtube"].get("load_workers"),
+            requests=config["youtube"].get("request_workers"),
+        )
+        resolver.configure(config["youtube"].get("resolver_processes"))
+
+        youtube.Entry.cache = cachestats.StatsTTLCache(
+            "entries",
+            maxsize=config["youtube"].get("entry_cache_size")
+            or youtube.Entry.cache_max_len,
+            ttl=config["youtube"].get("entry_cache_ttl") or youtube.Entry.cache_ttl,
+        )
+        YouTubeLibraryProvider.youtube_library_cache = cachestats.StatsTTLCache(
+            "browse",
+            maxsize=config["youtube"].get("browse_cache_size")
+            or YouTubeLibraryProvider.cache_max_len,
+            ttl=config["youtube"].get("browse_cache_ttl")
+            or YouTubeLibraryProvider.cache_ttl,
+        )
+        if config["youtube"].get("browse_cache_soft_ttl"):
+            YouTubeLibraryProvider.cache_soft_ttl = config["youtube"][
+                "browse_cache_soft_ttl"
+            ]
+
         youtube.musicapi_enabled = config["youtube"]["musicapi_enabled"]
         if youtube.musicapi_enabled:
             global youtube_music
@@ -151,6 +293,14 @@ class YouTubeBackend(
         self.uri_schemes = ["youtube", "yt"]
         self.user_agent = "{}/{}".format(Extension.dist_name, Extension.version)
 
+        # the state that Mopidy is about to restore has to be read now, since
+        # Mopidy deletes it once it has been restored
+        self.warm_up = None
+        if config["core"].get("restore_state"):
+            self.warm_up = warmup.WarmUp.from_state_file(
+                pathlib.Path(config["core"]["data_dir"]) / "core" / "state.json.gz"
+            )
+
     def on_start(self):
         proxy = httpclient.format_proxy(self.config["proxy"])
         youtube.Video.proxy = proxy
@@ -162,11 +312,56 @@ class YouTubeBackend(
 
         if self.config["youtube"]["allow_cache"]:
             youtube.cache_location = Extension.get_cache_dir(self.config)
+            max_size = self.config["youtube"].get("cache_max_size")
+            youtube.cache_index = cachedir.CacheIndex(
+                youtube.cache_location,
+                max_size=max_size * 1024 * 1024 if max_size else None,
+            )
+            youtube.cache_index.on_evict = youtube.Video.uncache
+            if self.warm_up:
+                # the tracklist that is about to be restored, which is only
+                # protected by tracklist_changed once it has been
+                youtube.cache_index.protected = set(self.warm_up.tracklist_ids)
+            youtube.cache_index.scan()
+            youtube.thumbnail_cache = thumbnails.ThumbnailCache(
+                youtube.cache_index, proxy=proxy, headers=headers
+            )
+            # in kilobytes per second
+            ratelimit = self.config["youtube"].get("download_ratelimit")
+            youtube.download_queue = downloads.DownloadQueue(
+                youtube.Video.download,
+                state_file=Extension.get_data_dir(self.config) / "downloads.json",
+                concurrency=self.config["youtube"].get("download_workers"),
+                ratelimit=ratelimit and ratelimit * 1024,
+            )
+            self._resume_downloads()
             logger.info(f"file caching enabled (at {youtube.cache_location})")
         else:
             youtube.cache_location = None
+            youtube.cache_index = None
+            youtube.thumbnail_cache = None
+            youtube.download_queue = None
             logger.info("file caching not enabled")
 
+        if self.config["youtube"].get("cache_metadata"):
+            try:
+                youtube.metadata_store = storage.MetadataStore(
+                    Extension.get_cache_dir(self.config) / "metadata.sqlite3"
+                )
+                logger.info(
+                    f"metadata caching enabled (at {youtube.metadata_store.path})"
+                )
+            except Exception as e:
+                logger.error(f"could not open metadata store, not caching: {e}")
+                youtube.metadata_store = None
+        else:
+            youtube.metadata_store = None
+
+        youtube.youtube_dl_cachedir = (
+            Extension.get_cache_dir(self.config) / "youtube_dl"
+        )
+        workers.submit("background", self._warm_up_resolver, priority=workers.PREFETCH)
+
         if youtube.api_enabled is True:
             youtube.Entry.api = youtube_api.API(proxy, headers)
             if youtube.Entry.search(q="test") is None:
@@ -231,6 +426,47 @@ class YouTubeBackend(
             # if youtube.api_enabled:
             #     youtube.Entry.api.list_playlists = music.list_playlists
 
+        if self.warm_up:
+            logger.info(
+                f"warming up {len(self.warm_up.tracklist_ids)} queued and "
+                f"{len(self.warm_up.history_ids)} played tracks"
+            )
+            self.warm_up.start()
+
+    def _resume_downloads(self):
+        unfinished = youtube.download_queue.saved()
+        if unfinished:
+            logger.info(f"resuming {len(unfinished)} unfinished downloads")
+        for video_id in unfinished:
+            # what there is of it isn't cached until it has all been downloaded
+            partial = youtube.cache_index.find(video_id, cachedir.audio_formats)
+            if partial:
+                youtube.cache_index.discard(partial)
+            youtube.download_queue.put(video_id)
+
+    def _warm_up_resolver(self):
+        try:
+            resolver.warm_up(
+                youtube.youtube_dl_package, youtube.Video.youtube_dl_options()
+            )
+        except Exception as e:
+            logger.error(f"could not start {youtube.youtube_dl_package}: {e}")
+
+    def on_stop(self):
+        if self.warm_up:
+            self.warm_up.stop()
+        if youtube.download_queue:
+            youtube.download_queue.stop()
+        workers.shutdown()
+        resolver.shutdown()
+
+        for name, cache in cachestats.caches.items():
+            logger.info(f"{name} cache: {cache.stats()}")
+
+        if youtube.metadata_store:
+            youtube.metadata_store.close()
+            youtube.metadata_store = None
+
     def add_track_to_history(self, bId):
         # this should be done in .youtube, by reference to the relevant API.  But for now...
 
@@ -284,11 +520,105 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
     """
     cache_max_len = 4000
     cache_ttl = 21600
+    # listings older than this (in seconds) are still returned, but checked
+    # for changes in the background
+    cache_soft_ttl = 600
+    # the background work started for a browse or search is dropped once
+    # the next one starts, and that of any of them (or of a lookup) once it
+    # hasn't been started for this many seconds (see workers.operation)
+    operation_timeout = 300
+
+    # {uri: (refs, video_count, fetched_at)}, where video_count is that of the
+    # playlist, if uri is a playlist, when it was listed. The size and ttls
+    # can be configured (see YouTubeBackend)
+    youtube_library_cache = cachestats.StatsTTLCache(
+        "browse", maxsize=cache_max_len, ttl=cache_ttl
+    )
+    youtube_library_cache_lock = threading.Lock()
+    revalidating = set()
+
+    @workers.operation("browse", timeout=operation_timeout)
+    def browse(self, uri):
+        with self.youtube_library_cache_lock:
+            cached = self.youtube_library_cache.get(uri)
+        if cached is None:
+            refs = self._browse(uri)
+            if refs is not None:
+                self._cache_refs(uri, refs)
+            return refs
+
+        refs, _, fetched_at = cached
+        if time.time() - fetched_at > self.cache_soft_ttl:
+            self._start_revalidating(uri)
+        return refs
+
+    def refresh(self, uri=None):
+        """
+        Called through core.library.refresh(). Has the browse listing of 'uri'
+        (or, if no uri is given, every listing) checked for changes in the
+        background; until then, the current listings are still returned.
+        """
+        with self.youtube_library_cache_lock:
+            uris = [uri] if uri else list(self.youtube_library_cache)
+        for uri in uris:
+            self._start_revalidating(uri)
+
+    def _cache_refs(self, uri, refs, video_count=None):
+        if video_count is None and extract_playlist_id(uri):
+            field = youtube.Playlist.get(extract_playlist_id(uri))._video_count
+            video_count = field.get() if field and field.is_set() else None
+        with self.youtube_library_cache_lock:
+            self.youtube_library_cache[uri] = (refs, video_count, time.time())
+
+    def _start_revalidating(self, uri):
+        with self.youtube_library_cache_lock:
+            if uri in self.revalidating or uri not in self.youtube_library_cache:
+                return
+            self.revalidating.add(uri)
+        task = workers.submit(
+            "background", self._revalidate, uri, priority=workers.PREFETCH
+        )
+        # also if it is dropped with the operation it was started for
+        task.add_done_callback(lambda _: self._done_revalidating(uri))
 
-    youtube_library_cache = TTLCache(maxsize=cache_max_len, ttl=cache_ttl)
+    def _done_revalidating(self, uri):
+        with self.youtube_library_cache_lock:
+            self.revalidating.discard(uri)
 
-    @cached(cache=youtube_library_cache)
-    def browse(self, uri):
+    def _revalidate(self, uri):
+        """
+        lists 'uri' again, replacing the cached listing if it has changed. For
+        a playlist, that is only done if its video_count has changed.
+        """
+        try:
+            with self.youtube_library_cache_lock:
+                if uri not in self.youtube_library_cache:
+                    return
+                refs, video_count, _ = self.youtube_library_cache[uri]
+
+            playlist_id = extract_playlist_id(uri)
+            with comms.fresh():
+                if playlist_id:
+                    playlist = youtube.Playlist.get(playlist_id)
+                    youtube.Playlist.refresh([playlist])
+                    new_video_count = playlist.video_count.get()
+                    if video_count is not None and new_video_count == video_count:
+                        self._cache_refs(uri, refs, video_count)
+                        return
+                    playlist._load_videos(replace=True)
+                else:
+                    new_video_count = None
+
+                new_refs = self._browse(uri)
+            if new_refs is None:
+                new_refs = refs
+            elif new_refs != refs:
+                logger.debug(f"browse listing of {uri} has changed")
+            self._cache_refs(uri, new_refs, new_video_count)
+        except Exception as e:
+            logger.error(f"error checking browse listing of {uri}: {e}")
+
+    def _browse(self, uri):
         if uri == "youtube:browse":
             return [
                 Ref.directory(uri="youtube:channel:root", name="My Youtube playlists"),
@@ -327,6 +657,13 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
             # albums = []
             playlists = youtube.Channel.playlists(extract_channel_id(uri))
             if playlists:
+                if self.serves_thumbnails():
+                    workers.submit(
+                        "background",
+                        self._prefetch_playlist_thumbnails,
+                        playlists,
+                        priority=workers.PREFETCH,
+                    )
                 for pl in playlists:
                     #     # pl.videos  # should we avoid this here, if it gets done in youtube.Channel.playlists
                     #     albums.append(convert_playlist_to_album(pl))
@@ -358,6 +695,7 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
     all info will be ready by that time.
     """
 
+    @workers.operation("search", timeout=operation_timeout)
     def search(self, query=None, uris=None, exact=False):
         # TODO Support exact search
         logger.debug('youtube LibraryProvider.search "%s"', query)
@@ -388,6 +726,7 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
 
         # load video info (to get length) of all videos together
         youtube.Video.load_info([entry for entry in entries if entry.is_video])
+        self.prefetch_thumbnails(entries)
 
         albums = []
         artists = []
@@ -401,7 +740,8 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
         # ready by the time the user adds search results to the playing queue
         for pl in playlists:
             albums.append(convert_playlist_to_album(pl))
-            pl.videos  # start loading
+            with workers.priority(workers.PREFETCH):
+                pl.videos  # start loading
 
         search_result = SearchResult(
             uri="youtube:search", tracks=tracks, artists=artists, albums=albums
@@ -411,12 +751,15 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
 
     def lookup_video_track(self, video_id: str) -> Track:
         if youtube.cache_location:
-            if f"{video_id}.json" in os.listdir(youtube.cache_location):
-                with open(
-                    os.path.join(youtube.cache_location, f"{video_id}.json"), "r"
-                ) as infile:
-                    track = json.load(infile, object_hook=model_json_decoder)
-                return track
+            cached = youtube.cache_index.find(video_id, ["json"])
+            if cached:
+                try:
+                    with open(youtube.cache_index.path(cached), "r") as infile:
+                        track = json.load(infile, object_hook=model_json_decoder)
+                    return track
+                except OSError as e:
+                    logger.debug(f"cached metadata for {video_id} has gone: {e}")
+                    youtube.cache_index.discard(cached)
 
         video = youtube.Video.get(video_id)
         video.title.get()
@@ -431,6 +774,7 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
         videos = [
             video for video in playlist.videos.get() if video.length.get() is not None
         ]
+        self.prefetch_thumbnails([playlist] + videos)
 
         tracks = [
             convert_video_to_track(
@@ -456,6 +800,7 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
 
         return tracks
 
+    @workers.operation(timeout=operation_timeout)
     def lookup(self, uri):
         """
         Called when the user adds a track to the playing queue, either from the
@@ -510,44 +855,61 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
         logger.error(f"Cannot load {uri}")
         return [Track(uri=None, name=None)]
 
+    def serves_thumbnails(self):
+        """
+        whether thumbnails are cached, and served by the http frontend
+        """
+        return bool(
+            youtube.thumbnail_cache and self.backend.config.get("http").get("enabled")
+        )
+
+    def prefetch_thumbnails(self, entries):
+        if self.serves_thumbnails():
+            youtube.thumbnail_cache.prefetch(entries)
+
+    def _prefetch_playlist_thumbnails(self, playlists):
+        # Channel.playlists only sets their titles and video counts, so the
+        # thumbnails of all of them are loaded together here, rather than one
+        # playlist at a time by the thumbnail cache
+        youtube.Playlist.load_info(playlists)
+        self.prefetch_thumbnails(playlists)
+
     def get_images(self, uris):
         images = {}
 
         if not isinstance(uris, list):
             uris = [uris]
 
-        video_ids = [extract_video_id(uri) for uri in uris]
-
-        if youtube.cache_location and self.backend.config.get("http").get("enabled"):
-            for uri in uris:
-                video_id = extract_video_id(uri)
-                if video_id:
-                    if f"{video_id}.webp" in os.listdir(youtube.cache_location):
-                        images.update({uri: [Image(uri=f"/youtube/{video_id}.webp")]})
-                    elif f"{video_id}.jpg" in os.listdir(youtube.cache_location):
-                        images.update({uri: [Image(uri=f"/youtube/{video_id}.jpg")]})
-
-            logger.debug(
-                f"using cached images: {[extract_video_id(uri) for uri in images]}"
+        entries = {}
+        for uri in uris:
+            playlist_id = extract_playlist_id(uri)
+            video_id = extract_video_id(uri)
+            if playlist_id:
+                entries[uri] = youtube.Playlist.get(playlist_id)
+            elif video_id:
+                entries[uri] = youtube.Video.get(video_id)
+
+        if self.serves_thumbnails():
+            for uri, entry in entries.items():
+                cached = youtube.thumbnail_cache.images(entry.id)
+                if cached:
+                    images[uri] = cached
+
+            logger.debug(f"using cached images: {[entries[uri].id for uri in images]}")
+
+            # the others are served from youtube this time, and locally once
+            # they have been fetched
+            self.prefetch_thumbnails(
+                [entry for uri, entry in entries.items() if uri not in images]
             )
 
         images.update(
             {
-                uri: youtube.Video.get(video_id).thumbnails.get()
-                for uri, video_id in zip(uris, video_ids)
-                if video_id
+                uri: entry.thumbnails.get()
+                for uri, entry in entries.items()
                 if uri not in images
             }
         )
-
-        playlist_ids = [extract_playlist_id(uri) for uri in uris]
-        images.update(
-            {
-                uri: youtube.Playlist.get(playlist_id).thumbnails.get()
-                for uri, playlist_id in zip(uris, playlist_ids)
-                if playlist_id
-            }
-        )
         return images
 
 
@@ -570,7 +932,10 @@ class YouTubePlaybackProvider(backend.PlaybackProvider):
         #     return None
 
         try:
-            return youtube.Video.get(video_id).audio_url.get()
+            # stream urls expire, so resolve again if needed; anything this
+            # needs from the workers goes ahead of everything else
+            with workers.priority(workers.PLAYBACK):
+                return youtube.Video.get(video_id).refresh_audio_url().get()
         except Exception as e:
             logger.error('translate_uri error "%s"', e)
             return None
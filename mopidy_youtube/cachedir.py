@@ -0,0 +1,238 @@
+import os
+import threading
+from collections import OrderedDict
+
+from mopidy_youtube import logger
+
+audio_formats = ("webm", "m4a", "mp3", "ogg")
+image_formats = ("webp", "jpg")
+cached_formats = audio_formats + image_formats + ("json",)
+
+
+def split_filename(filename):
+    """
+    returns the id and the extension of a cached file. Ids don't contain
+    dots, so the extension is everything after the first one; the variants of
+    an image (see ThumbnailCache) have extensions like "small.jpg".
+    """
+    id, _, ext = os.path.basename(filename).partition(".")
+    return id, ext
+
+
+def is_cached_format(ext):
+    return ext.rsplit(".", 1)[-1] in cached_formats
+
+
+def shard_path(root, filename):
+    """
+    returns the path of a cached file. Files are kept in subdirectories named
+    after the first two characters of the id, so that no single directory
+    gets too big.
+    """
+    return os.path.join(root, filename[:2], filename)
+
+
+class CacheIndex:
+    """
+    In-memory index of the files in the cache directory, mapping each video id
+    to the extensions (audio, json, image) that are cached for it, and their
+    sizes.
+
+    The index is built once, when the backend starts, and kept up to date by
+    the code that writes to the cache directory, so that finding out whether
+    something is cached doesn't mean listing the directory every time. Files
+    found directly in the cache directory (as they were kept before it was
+    sharded; see shard_path) are moved into place when the index is built.
+
+    If max_size (in bytes) is set, the least recently played ids are evicted,
+    in the background, whenever the cache grows beyond it. Ids in 'protected'
+    (the current and queued tracks) are never evicted.
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = str(root)
+        self.max_size = max_size
+        self.total_bytes = 0
+        self.protected = set()
+        self.on_evict = None
+        self._lock = threading.Lock()
+        self._files = {}
+        # ids, least recently played first
+        self._used = OrderedDict()
+        self._evict_lock = threading.Lock()
+        self._evict_wanted = threading.Event()
+        self._evictor = None
+
+    def scan(self):
+        self._migrate()
+        files = {}
+        mtimes = {}
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        id, ext = split_filename(entry.name)
+                        if not is_cached_format(ext) or not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        files.setdefault(id, {})[ext] = stat.st_size
+                        mtimes[id] = max(mtimes.get(id, 0), stat.st_mtime)
+        with self._lock:
+            self._files = files
+            self._used = OrderedDict(
+                (id, None) for id in sorted(mtimes, key=mtimes.get)
+            )
+            self.total_bytes = sum(sum(exts.values()) for exts in files.values())
+        logger.debug(
+            f"indexed {len(files)} cached ids in {self.root} "
+            f"({self.total_bytes} bytes)"
+        )
+        self._check_size()
+
+    def _migrate(self):
+        """
+        moves files from the flat layout into their shards
+        """
+        moved = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                ext = split_filename(entry.name)[1]
+                if not is_cached_format(ext) or not entry.is_file():
+                    continue
+                target = shard_path(self.root, entry.name)
+                try:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(entry.path, target)
+                    moved += 1
+                except OSError as e:
+                    logger.error(f"could not move {entry.name} into its shard: {e}")
+        if moved:
+            logger.info(f"moved {moved} cached files into the sharded layout")
+
+    def add(self, filename):
+        id, ext = split_filename(filename)
+        try:
+            size = os.path.getsize(self.path(f"{id}.{ext}"))
+        except OSError:
+            size = 0
+        with self._lock:
+            exts = self._files.setdefault(id, {})
+            self.total_bytes += size - exts.get(ext, 0)
+            exts[ext] = size
+            self._used[id] = None
+            self._used.move_to_end(id)
+        self._check_size()
+
+    def discard(self, filename):
+        id, ext = split_filename(filename)
+        with self._lock:
+            exts = self._files.get(id)
+            if exts and ext in exts:
+                self.total_bytes -= exts.pop(ext)
+                if not exts:
+                    del self._files[id]
+                    self._used.pop(id, None)
+
+    def find(self, id, formats):
+        """
+        returns the filename of the first of 'formats' cached for 'id', or None
+        """
+        with self._lock:
+            exts = self._files.get(id, ())
+            for ext in formats:
+                if ext in exts:
+                    return f"{id}.{ext}"
+        return None
+
+    def path(self, filename, create=False):
+        """
+        returns the path of a cached file; if 'create', makes sure that the
+        directory it belongs in exists
+        """
+        path = shard_path(self.root, filename)
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def entries(self):
+        """
+        returns a list of (id, extensions) for everything in the cache
+        """
+        with self._lock:
+            return [(id, list(exts)) for id, exts in self._files.items()]
+
+    def touch(self, id):
+        """
+        marks 'id' as the most recently played. The modification time of its
+        audio is updated too, so that the order survives a restart.
+        """
+        with self._lock:
+            if id not in self._used:
+                return
+            self._used.move_to_end(id)
+        cached = self.find(id, audio_formats)
+        if cached:
+            try:
+                os.utime(self.path(cached))
+            except OSError as e:
+                logger.debug(f"could not touch {cached}: {e}")
+
+    def evict(self):
+        """
+        removes the files of the least recently played ids until the cache
+        is within max_size. Returns the ids evicted.
+        """
+        with self._evict_lock:
+            victims = self._evict()
+        if victims:
+            logger.debug(f"evicted {len(victims)} ids from the cache")
+        return victims
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            if self.max_size is None:
+                return victims
+            excess = self.total_bytes - self.max_size
+            for id in self._used:
+                if excess <= 0:
+                    break
+                if id in self.protected:
+                    continue
+                victims.append(id)
+                excess -= sum(self._files.get(id, {}).values())
+
+        for id in victims:
+            with self._lock:
+                exts = self._files.pop(id, {})
+                self._used.pop(id, None)
+                self.total_bytes -= sum(exts.values())
+            for ext in exts:
+                try:
+                    os.remove(self.path(f"{id}.{ext}"))
+                except OSError as e:
+                    logger.debug(f"could not evict {id}.{ext}: {e}")
+            if self.on_evict:
+                self.on_evict(id)
+
+        return victims
+
+    def _check_size(self):
+        if self.max_size is not None and self.total_bytes > self.max_size:
+            if self._evictor is None:
+                self._evictor = threading.Thread(
+                    target=self._evict_loop, name="YouTubeCacheEvictor", daemon=True
+                )
+                self._evictor.start()
+            self._evict_wanted.set()
+
+    def _evict_loop(self):
+        while True:
+            self._evict_wanted.wait()
+            self._evict_wanted.clear()
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"cache eviction error {e}")
@@ -0,0 +1,91 @@
+import statistics
+import time
+from collections import deque
+
+from cachetools import TTLCache
+
+# every StatsTTLCache, by name, so that they can be reported on
+caches = {}
+
+
+class StatsTTLCache(TTLCache):
+    """
+    A TTLCache that keeps count of hits and misses (of lookups through get()),
+    of evictions (items dropped to make room for new ones) and expirations,
+    and of how long evicted items had been in the cache, so that its size can
+    be chosen from real data rather than guessed.
+
+    Like TTLCache, it isn't thread safe; callers hold a lock around it.
+    """
+
+    def __init__(self, name, maxsize, ttl, timer=time.monotonic):
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # ages (in seconds) of the most recently evicted items
+        self.evicted_ages = deque(maxlen=1000)
+        self._added = {}
+        self._removed_added = None
+        self._clearing = False
+        caches[name] = self
+
+    def get(self, key, default=None):
+        if key in self:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        new = key not in self
+        super().__setitem__(key, value)
+        if new:
+            self._added[key] = self.timer()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._removed_added = self._added.pop(key, None)
+
+    def popitem(self):
+        key, value = super().popitem()
+        # depending on the version of cachetools, clear() may pop every item;
+        # those aren't evictions
+        if not self._clearing:
+            self.evictions += 1
+            if self._removed_added is not None:
+                self.evicted_ages.append(self.timer() - self._removed_added)
+        return key, value
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, _ in expired:
+            self._added.pop(key, None)
+        self.expirations += len(expired)
+        return expired
+
+    def clear(self):
+        self._clearing = True
+        try:
+            super().clear()
+        finally:
+            self._clearing = False
+        self._added.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        ages = list(self.evicted_ages)
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "evicted_age_min": round(min(ages)) if ages else None,
+            "evicted_age_median": round(statistics.median(ages)) if ages else None,
+        }
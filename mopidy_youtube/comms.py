@@ -1,9 +1,62 @@
+import asyncio
+import json
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 
 import requests
-from requests.adapters import HTTPAdapter
+from requests.adapters import BaseAdapter, HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from requests.packages.urllib3.util.timeout import Timeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from mopidy_youtube import logger
+from mopidy_youtube.cachestats import StatsTTLCache
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    # what httpx needs for HTTP/2 (httpx[http2])
+    import h2
+except ImportError:
+    h2 = None
+
+_local = threading.local()
+
+
+def http2_available():
+    """
+    whether httpx is installed, along with its HTTP/2 support
+    """
+    return httpx is not None and h2 is not None
+
+
+@contextmanager
+def fresh():
+    """
+    requests made in this block, in this thread, bypass the response cache
+    (see CachingSession), eg when something is being loaded again because it
+    may have changed
+    """
+    previous = getattr(_local, "fresh", False)
+    _local.fresh = True
+    try:
+        yield
+    finally:
+        _local.fresh = previous
+
+
+def is_fresh():
+    """
+    whether this thread is in a fresh() block
+    """
+    return getattr(_local, "fresh", False)
 
 
 # is this necessary or worthwhile?  Are there any bad
@@ -22,7 +75,196 @@ class MyHTTPAdapter(HTTPAdapter):
         return super(MyHTTPAdapter, self).init_poolmanager(*args, **kwargs)
 
 
+class HTTPXAdapter(BaseAdapter):
+    """
+    A transport adapter that makes the requests of a requests.Session with
+    httpx, over HTTP/2 where the server supports it, on one event loop that
+    runs in the background. Requests made at the same time by many threads
+    are multiplexed over a single connection per host, instead of each
+    taking a connection of its own.
+
+    Responses are read in full before they are returned (even with
+    stream=True). Like MyHTTPAdapter, requests that fail to connect, or that
+    get one of 'status_forcelist', are retried.
+    """
+
+    timeout = (6.05, 27)
+    # headers that only apply to a single HTTP/1.1 connection
+    hop_by_hop = {"connection", "keep-alive", "proxy-connection", "upgrade"}
+
+    _loop = None
+    _loop_lock = threading.Lock()
+
+    def __init__(
+        self,
+        retries=10,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 504),
+        transport=None,
+    ):
+        super().__init__()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self._transport = transport
+        self._client = None
+
+    @classmethod
+    def loop(cls):
+        """
+        returns the event loop that all HTTPXAdapters share, starting it if
+        it isn't running yet
+        """
+        with cls._loop_lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=cls._loop.run_forever, name="YouTubeHTTP2", daemon=True
+                ).start()
+            return cls._loop
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ):
+        return asyncio.run_coroutine_threadsafe(
+            self._send(request, timeout, verify, proxies or {}), self.loop()
+        ).result()
+
+    def close(self):
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self.loop())
+            self._client = None
+
+    async def _send(self, request, timeout, verify, proxies):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                verify=verify,
+                proxy=proxies.get("https") or proxies.get("http"),
+                transport=self._transport,
+            )
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in self.hop_by_hop
+        }
+        if timeout is None:
+            timeout = self.timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(min(self.backoff_factor * 2 ** (attempt - 1), 120))
+            try:
+                response = await self._client.request(
+                    request.method,
+                    request.url,
+                    headers=headers,
+                    content=request.body,
+                    timeout=httpx.Timeout(read, connect=connect),
+                )
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise requests.ConnectionError(e, request=request)
+                logger.debug(f"retrying {request.url}: {e}")
+                continue
+            if response.status_code in self.status_forcelist:
+                if attempt < self.retries:
+                    continue
+            return self.build_response(request, response)
+
+    def build_response(self, request, response):
+        built = requests.Response()
+        built.status_code = response.status_code
+        built.reason = response.reason_phrase
+        built.headers = CaseInsensitiveDict(response.headers)
+        built.encoding = get_encoding_from_headers(built.headers)
+        built.url = request.url
+        built.request = request
+        built.connection = self
+        # already decoded by httpx
+        built._content = response.content
+        built._content_consumed = True
+        return built
+
+
+class CachingSession(requests.Session):
+    """
+    A requests.Session that keeps the responses to requests for the pages and
+    searches in 'ttls' in memory, for the number of seconds given there, so
+    that the same page asked for by different code paths within a few minutes
+    is only fetched once.
+
+    Pass cache=False (or make the request within fresh()) for a response that
+    is fetched now; it still replaces the cached one.
+    """
+
+    # (pattern matching the url, seconds to keep the response for)
+    ttls = [
+        (re.compile(r"youtube\.com/watch\b"), 900),
+        (re.compile(r"youtube\.com/playlist\b"), 600),
+        (re.compile(r"youtube\.com/channel/[^/]+/playlists"), 600),
+        (re.compile(r"youtube\.com/results\b"), 900),
+        (re.compile(r"youtube\.com/youtubei/v1/(search|next)\b"), 900),
+    ]
+
+    def __init__(self, name="responses", maxsize=200):
+        super().__init__()
+        # hits are requests answered from the cache
+        self.cache = StatsTTLCache(
+            name, maxsize=maxsize, ttl=max(ttl for _, ttl in self.ttls)
+        )
+        self.cache_lock = threading.Lock()
+
+    def request(self, method, url, *args, cache=True, **kwargs):
+        ttl = self._ttl(url)
+        if (
+            ttl is None
+            or args
+            or method.upper() not in ("GET", "POST")
+            or kwargs.get("stream")
+        ):
+            return super().request(method, url, *args, **kwargs)
+
+        key = self._key(method, url, kwargs)
+        if cache and not is_fresh():
+            with self.cache_lock:
+                stored = self.cache[key] if key in self.cache else None
+                if stored and time.monotonic() - stored[0] < ttl:
+                    self.cache.hits += 1
+                    return stored[1]
+                self.cache.misses += 1
+
+        response = super().request(method, url, **kwargs)
+        if response.status_code == 200:
+            response.content  # read it now, so that it can be read again
+            with self.cache_lock:
+                self.cache[key] = (time.monotonic(), response)
+        return response
+
+    def _ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    @staticmethod
+    def _key(method, url, kwargs):
+        return (
+            method.upper(),
+            url,
+            json.dumps(kwargs.get("params"), sort_keys=True, default=str),
+            json.dumps(kwargs.get("data"), sort_keys=True, default=str),
+            json.dumps(kwargs.get("json"), sort_keys=True, default=str),
+        )
+
+
 class Client:
+    # whether to keep responses in a CachingSession, and whether to make
+    # https requests with an HTTPXAdapter; set from the config
+    cache_responses = False
+    http2 = False
+
     def __init__(self, proxy, headers):
         if not hasattr(type(self), "session"):
             self._create_session(proxy, headers)
@@ -37,7 +279,12 @@ class Client:
         status_forcelist=(500, 502, 504),
         session=None,
     ):
-        cls.session = session or requests.Session()
+        if session is None:
+            if cls.cache_responses:
+                session = CachingSession(name=f"{cls.__name__} responses")
+            else:
+                session = requests.Session()
+        cls.session = session
         retry = Retry(
             total=retries,
             read=retries,
@@ -50,5 +297,14 @@ class Client:
         )
         cls.session.mount("http://", adapter)
         cls.session.mount("https://", adapter)
+        if cls.http2:
+            cls.session.mount(
+                "https://",
+                HTTPXAdapter(
+                    retries=retries,
+                    backoff_factor=backoff_factor,
+                    status_forcelist=status_forcelist,
+                ),
+            )
         cls.session.proxies = {"http": proxy, "https": proxy}
         cls.session.headers = headers
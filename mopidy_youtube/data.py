@@ -1,5 +1,6 @@
 import json
 import re
+from typing import Optional
 from urllib.parse import parse_qs, urlparse
 
 from mopidy_youtube.apis.ytm_item_to_video import ytm_item_to_video
@@ -20,6 +21,9 @@ old_uri_channel_regex = re.compile(
     r"^(?:youtube|yt):channel/(?:.+)\.(?P<channelid>.+)$"
 )
 
+# manifest urls carry the expiry in the path rather than the query
+url_expire_path_regex = re.compile(r"/expire/(?P<expire>[0-9]+)(?:/|$)")
+
 
 def format_video_uri(id) -> str:
     return f"youtube:video:{id}"
@@ -79,6 +83,26 @@ def extract_channel_id(uri) -> str:
     return ""
 
 
+def extract_expiry(url) -> Optional[int]:
+    """
+    returns the time (in seconds since the epoch) at which a googlevideo
+    stream url stops working, or None if it doesn't say (or isn't a url)
+    """
+    if not url or not isinstance(url, str):
+        return None
+    parsed = urlparse(url)
+    expire = parse_qs(parsed.query).get("expire")
+    if expire:
+        try:
+            return int(expire[0])
+        except ValueError:
+            return None
+    match = url_expire_path_regex.search(parsed.path)
+    if match:
+        return int(match.group("expire"))
+    return None
+
+
 def extract_preload_tracks(uri) -> dict:
     match = uri_preload_regex.match(uri)
     if match:
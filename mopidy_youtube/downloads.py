@@ -0,0 +1,285 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+
+from mopidy_youtube import logger, workers
+
+
+class DownloadQueue:
+    """
+    Downloads tracks into the cache (by calling download(id, videos)), no
+    more than 'concurrency' at a time, in order of priority (see workers) and,
+    within a priority, in the order they were queued. The current and next
+    tracks are moved to the front (see hurry), so that a long tracklist being
+    cached doesn't hold them up; PLAYBACK downloads start right away, even if
+    there are 'concurrency' other downloads under way already.
+
+    The ids that are queued or being downloaded are kept in 'state_file'
+    (written no more than once every 'save_delay' seconds), so that downloads
+    that hadn't finished when Mopidy stopped are queued again when it starts
+    (see saved); youtube_dl carries on from the part of the file that was
+    already downloaded.
+
+    Along with each id, the queue keeps the videos that asked for it (see
+    put), and hands them to download, which sets their audio_url; a video
+    that is looked up again by its id may be another object by then, if it
+    has been evicted from the entry cache in the meantime. The downloads
+    resumed from the state file haven't been asked for by any video yet.
+
+    With a 'ratelimit' (in bytes per second), the downloads that aren't
+    PLAYBACK share that much bandwidth between them, so that caching a
+    tracklist leaves room for the stream that is playing and for everything
+    else on the network; PLAYBACK downloads go at full speed (and, as they
+    don't wait for a slot, aren't held up by the slow ones). The limits are set in
+    the params of the downloads' YoutubeDL instances (see throttle), which
+    youtube_dl reads as it goes, so a download that is moved up speeds up
+    right away.
+    """
+
+    concurrency = 2
+    ratelimit = None
+    save_delay = 1.0
+
+    def __init__(self, download, state_file=None, concurrency=None, ratelimit=None):
+        self.download = download
+        self.state_file = state_file
+        if concurrency:
+            self.concurrency = concurrency
+        if ratelimit:
+            self.ratelimit = ratelimit
+        self._condition = threading.Condition()
+        # (priority, seq, id); ids that have been moved up are left behind
+        # with their old priority, and skipped
+        self._heap = []
+        self._seq = itertools.count()
+        # id: (priority, seq) of the ids that are queued
+        self._queued = {}
+        # id: priority of the ids that are being downloaded
+        self._active = {}
+        # id: params of the YoutubeDL instance downloading it (see throttle)
+        self._params = {}
+        # id: the videos that asked for it, while it is queued or downloaded
+        self._videos = {}
+        self._threads = 0
+        self._idle = 0
+        self._names = itertools.count()
+        self._stopping = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+
+    def put(self, id, priority=workers.PREFETCH, video=None):
+        """
+        queues the download of 'id', for 'video' if given, unless it is queued
+        or being downloaded already (in which case 'video' is added to the
+        ones it is for, and it is only moved up, if 'priority' is higher)
+        """
+        with self._condition:
+            if video is not None:
+                videos = self._videos.setdefault(id, [])
+                if not any(other is video for other in videos):
+                    videos.append(video)
+            if id in self._active:
+                self._raise_active(id, priority)
+                return
+            if id in self._queued and self._queued[id][0] <= priority:
+                return
+            self._push(id, priority)
+        self._save()
+
+    def hurry(self, id, priority=workers.PLAYBACK):
+        """
+        moves the download of 'id' up to 'priority', if it is queued or
+        being downloaded
+        """
+        with self._condition:
+            if id in self._active:
+                self._raise_active(id, priority)
+                return
+            if id not in self._queued or self._queued[id][0] <= priority:
+                return
+            self._push(id, priority)
+        self._save()
+
+    def pending(self):
+        """
+        returns the ids that are being downloaded, and then those that are
+        queued, in the order they will be downloaded
+        """
+        with self._condition:
+            queued = sorted(self._queued, key=self._queued.get)
+            return list(self._active) + queued
+
+    def throttle(self, id, params):
+        """
+        called by download with the params of the YoutubeDL instance that
+        downloads 'id', in which its rate limit is kept up to date until it
+        is done
+        """
+        with self._condition:
+            if id in self._active:
+                self._params[id] = params
+                self._set_limits()
+
+    def saved(self):
+        """
+        returns the ids in 'state_file': the downloads that hadn't finished
+        when it was last saved
+        """
+        if not self.state_file:
+            return []
+        try:
+            with open(self.state_file) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"could not read download queue {self.state_file}: {e}")
+            return []
+
+    def stop(self):
+        """
+        stops starting downloads; the ones that are under way stay in the
+        state file until they are done, to be resumed if they aren't
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+        self._write()
+
+    def _raise_active(self, id, priority):
+        if priority < self._active[id]:
+            self._active[id] = priority
+            self._set_limits()
+
+    def _set_limits(self):
+        throttled = [
+            id
+            for id, priority in self._active.items()
+            if priority != workers.PLAYBACK and id in self._params
+        ]
+        for id, params in self._params.items():
+            if self.ratelimit and id in throttled:
+                params["ratelimit"] = max(1, self.ratelimit // len(throttled))
+            else:
+                params["ratelimit"] = None
+
+    def _push(self, id, priority):
+        key = (priority, next(self._seq))
+        self._queued[id] = key
+        heapq.heappush(self._heap, key + (id,))
+        if self._idle < self._startable():
+            self._threads += 1
+            threading.Thread(
+                target=self._work,
+                name=f"YouTubeDownload-{next(self._names)}",
+                daemon=True,
+            ).start()
+        self._condition.notify_all()
+
+    def _startable(self):
+        """
+        returns how many of the queued downloads could start now
+        """
+        playback = sum(
+            1 for priority, seq in self._queued.values() if priority == workers.PLAYBACK
+        )
+        free = max(0, self.concurrency - len(self._active) - playback)
+        return playback + min(len(self._queued) - playback, free)
+
+    def _head(self):
+        """
+        returns the (priority, seq, id) that is next in line, if any, skipping
+        the ids that have been moved up since
+        """
+        while self._heap:
+            priority, seq, id = self._heap[0]
+            if self._queued.get(id) == (priority, seq):
+                return priority, seq, id
+            heapq.heappop(self._heap)
+        return None
+
+    def _next(self):
+        """
+        returns the next id to download, once it can start, or None if this
+        thread isn't needed any more
+        """
+        with self._condition:
+            while not self._stopping:
+                head = self._head()
+                if head:
+                    priority, seq, id = head
+                    if (
+                        priority == workers.PLAYBACK
+                        or len(self._active) < self.concurrency
+                    ):
+                        heapq.heappop(self._heap)
+                        del self._queued[id]
+                        self._active[id] = priority
+                        return id
+                if self._threads > self.concurrency:
+                    # one of the threads started for PLAYBACK downloads
+                    break
+                self._idle += 1
+                self._condition.wait()
+                self._idle -= 1
+            self._threads -= 1
+            return None
+
+    def _work(self):
+        while True:
+            id = self._next()
+            if id is None:
+                return
+            with self._condition:
+                # the same list, so that the videos that ask for it while it
+                # is being downloaded are set too
+                videos = self._videos.setdefault(id, [])
+            try:
+                self.download(id, videos)
+            except Exception as e:
+                logger.error(f"error downloading {id}: {e}")
+            with self._condition:
+                del self._active[id]
+                del self._videos[id]
+                if self._params.pop(id, None) is not None:
+                    # the others get its share
+                    self._set_limits()
+                # a download can start in its place
+                self._condition.notify_all()
+            self._save()
+
+    def _save(self):
+        """
+        has the state file written save_delay seconds from now, along with
+        any other changes made by then (or, once stopping, right away)
+        """
+        if not self.state_file:
+            return
+        with self._condition:
+            if not self._stopping:
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.save_delay, self._write)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+                return
+        self._write()
+
+    def _write(self):
+        if not self.state_file:
+            return
+        with self._condition:
+            self._save_timer = None
+        try:
+            with self._save_lock:
+                # written under another name first, so that a crash halfway
+                # through doesn't lose the queue
+                with open(f"{self.state_file}.tmp", "w") as outfile:
+                    json.dump(self.pending(), outfile)
+                os.replace(f"{self.state_file}.tmp", self.state_file)
+        except OSError as e:
+            logger.error(f"could not save download queue {self.state_file}: {e}")
@@ -3,7 +3,7 @@ import random
 import pykka
 from mopidy.core import listener
 
-from mopidy_youtube import logger, youtube
+from mopidy_youtube import logger, workers, youtube
 from mopidy_youtube.data import extract_video_id, format_video_uri
 
 autoplay_enabled = False
@@ -93,9 +93,10 @@ class YouTubeAutoplayer(pykka.ThreadingActor, listener.CoreListener):
 
             current_track = youtube.Video.get(current_track_id)
             logger.debug(f"triggered related videos for {current_track.id}")
-            current_track.related_videos
             logger.debug("getting related videos")
-            related_videos = current_track.related_videos.get()
+            # the next track depends on them
+            with workers.priority(workers.PLAYBACK):
+                related_videos = current_track.related_videos.get()
             logger.debug(
                 f"autoplayer is adding a track related to {current_track.title.get()}"
             )
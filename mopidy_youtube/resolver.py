@@ -0,0 +1,184 @@
+"""
+Resolving the stream urls of videos with youtube_dl.
+
+YoutubeDL instances are kept, by package and options, and used again for
+the next track, so that the player scripts and signature functions that they
+have loaded are loaded only once; with a 'cachedir' in the options, they are
+kept on disk too, for the next time Mopidy starts. An instance is only used by
+one thread at a time.
+
+Extracting the info of a video is mostly deciphering signatures, which is
+CPU-heavy pure Python that holds the GIL: done in Mopidy's process, it stalls
+the actors, the http server and GStreamer whenever tracks are resolved. With
+'processes' set (see configure), it is done in that many worker processes
+instead, which keep instances of their own, send back no more than the
+stream url, and can resolve several tracks at once on a machine with more
+than one core.
+
+Tracks that are cached (allow_cache) are still downloaded in Mopidy's
+process, by instances of their own, as the download reports its progress to
+it.
+"""
+
+import importlib
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from mopidy_youtube import logger
+
+# the number of worker processes; 0 resolves in Mopidy's process
+processes = 0
+
+_executor = None
+_lock = threading.Lock()
+# the calls that haven't finished, which shutdown cancels
+_futures = set()
+# idle YoutubeDL instances, by package and options
+_instances = {}
+
+
+class ResolveError(Exception):
+    """
+    An error of youtube_dl, with its message (which is all that is sure to
+    survive being sent back from a worker process)
+    """
+
+
+def configure(n):
+    global processes
+    shutdown()
+    processes = n or 0
+
+
+def resolve(package, options, url):
+    """
+    returns the stream url of the video at 'url', as extracted by
+    'package' (youtube_dl or yt_dlp) with 'options', in a worker process
+    """
+    global _executor
+    executor = _get_executor()
+    try:
+        return _submit(executor, _resolve, package, options, url).result()
+    except BrokenProcessPool:
+        # a worker died (killed for using too much memory, say); the pool is
+        # started again for the next track
+        with _lock:
+            if _executor is executor:
+                _executor = None
+        raise
+
+
+def warm_up(package, options):
+    """
+    has the instances that resolve() will use made, along with the worker
+    processes, if any, so that the first track doesn't wait for them
+    """
+    if not processes:
+        _warm_up(importlib.import_module(package), options)
+        return
+    executor = _get_executor()
+    for future in [
+        _submit(executor, _warm_up_worker, package, options) for _ in range(processes)
+    ]:
+        future.result()
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+        instances = [ydl for idle in _instances.values() for ydl in idle]
+        _instances.clear()
+        futures = list(_futures)
+    # what shutdown(cancel_futures=True) does, which needs Python 3.9
+    for future in futures:
+        future.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False)
+    for ydl in instances:
+        _close(ydl)
+
+
+@contextmanager
+def instance(youtube_dl, options):
+    """
+    lends out an idle YoutubeDL instance of the module 'youtube_dl' (or
+    yt_dlp) with 'options', which have to be hashable values, or a new one if
+    there is none
+    """
+    key = (youtube_dl, tuple(sorted(options.items())))
+    with _lock:
+        idle = _instances.setdefault(key, [])
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        # entered for as long as it is kept (see shutdown)
+        ydl = youtube_dl.YoutubeDL(options).__enter__()
+    try:
+        yield ydl
+    finally:
+        with _lock:
+            _instances.setdefault(key, []).append(ydl)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # not forked: Mopidy's process has threads (and GStreamer) that
+            # the copy of it would be in no state to use
+            _executor = ProcessPoolExecutor(
+                processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_ignore_interrupts,
+            )
+        return _executor
+
+
+def _submit(executor, fn, *args):
+    future = executor.submit(fn, *args)
+    with _lock:
+        _futures.add(future)
+    future.add_done_callback(_forget)
+    return future
+
+
+def _forget(future):
+    with _lock:
+        _futures.discard(future)
+
+
+def _close(ydl):
+    # which saves the cookies, if there is a cookiefile
+    try:
+        ydl.__exit__(None, None, None)
+    except Exception as e:
+        logger.debug(f"error closing youtube_dl: {e}")
+
+
+def _ignore_interrupts():
+    # Ctrl-C reaches the whole process group; Mopidy stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _resolve(package, options, url):
+    try:
+        with instance(importlib.import_module(package), options) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        raise ResolveError(str(e)) from None
+    return info["url"]
+
+
+def _warm_up_worker(package, options):
+    _warm_up(importlib.import_module(package), options)
+
+
+def _warm_up(youtube_dl, options):
+    with instance(youtube_dl, options) as ydl:
+        # the extractor is made (and the list of extractors loaded) when it
+        # is first asked for
+        ydl.get_info_extractor("Youtube")
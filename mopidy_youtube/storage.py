@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from mopidy.models import ModelJSONEncoder, model_json_decoder
+
+from mopidy_youtube import logger
+
+
+class MetadataStore:
+    """
+    Persistent store for Video and Playlist metadata, backed by sqlite.
+
+    Every field of every entry is stored in its own row, together with the time
+    at which it was fetched, so that known entries can be rebuilt after a restart
+    without going back to the network.
+
+    Entries loaded together (a page of search results, the videos of a
+    playlist) are saved in one transaction (see batch), rather than one each,
+    which would mean hundreds of syncs to disk per listing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fields ("
+                "kind TEXT NOT NULL, "
+                "id TEXT NOT NULL, "
+                "field TEXT NOT NULL, "
+                "value TEXT, "
+                "fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, id, field))"
+            )
+        logger.debug(f"metadata store opened at {path}")
+
+    def load(self, kind, ids):
+        """
+        returns {id: {field: (value, fetched_at)}} for those of the given ids
+        that are in the store
+        """
+        ids = list(ids)
+        stored = {}
+        with self._lock:
+            # stay well below sqlite's limit on the number of host parameters
+            for i in range(0, len(ids), 500):
+                sublist = ids[i : i + 500]
+                rows = self._connection.execute(
+                    "SELECT id, field, value, fetched_at FROM fields "
+                    f"WHERE kind = ? AND id IN ({','.join('?' * len(sublist))})",
+                    [kind, *sublist],
+                ).fetchall()
+                for id, field, value, fetched_at in rows:
+                    try:
+                        value = json.loads(value, object_hook=model_json_decoder)
+                    except Exception as e:
+                        logger.debug(f"metadata store: bad {field} for {id}: {e}")
+                        continue
+                    stored.setdefault(id, {})[field] = (value, fetched_at)
+        return stored
+
+    @contextmanager
+    def batch(self):
+        """
+        what is saved in this block, in this thread, is written when it ends,
+        in one transaction
+        """
+        if getattr(self._local, "rows", None) is not None:
+            # in the block of another batch, which writes it all
+            yield
+            return
+        self._local.rows = []
+        try:
+            yield
+        finally:
+            rows, self._local.rows = self._local.rows, None
+            try:
+                self._write(rows)
+            except Exception as e:
+                logger.error(f"metadata store save error {e} ({len(rows)} rows)")
+
+    def save(self, kind, id, values, fetched_at=None):
+        """
+        stores the given {field: value} for an entry (at the end of the
+        batch, if in one)
+        """
+        fetched_at = fetched_at or time.time()
+        try:
+            rows = [
+                (kind, id, field, json.dumps(value, cls=ModelJSONEncoder), fetched_at)
+                for field, value in values.items()
+            ]
+        except Exception as e:
+            logger.debug(f"metadata store: cannot store {id}: {e}")
+            return
+        pending = getattr(self._local, "rows", None)
+        if pending is not None:
+            pending.extend(rows)
+        else:
+            self._write(rows)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO fields "
+                "(kind, id, field, value, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,210 @@
+import os
+import threading
+
+import requests
+from cachetools import TTLCache
+from mopidy.models import Image
+from requests.adapters import HTTPAdapter
+
+from mopidy_youtube import comms, logger, workers
+from mopidy_youtube.cachedir import image_formats
+
+try:
+    import PIL.Image
+except ImportError:
+    PIL = None
+
+# the first bytes of the image formats that can be cached
+magic_numbers = {b"\xff\xd8\xff": "jpg", b"RIFF": "webp"}
+
+
+def image_format(magic):
+    """
+    returns the extension of an image that starts with 'magic', or None
+    """
+    for prefix, ext in magic_numbers.items():
+        if magic.startswith(prefix):
+            return ext
+    return None
+
+
+class ThumbnailCache:
+    """
+    Keeps the thumbnails of videos and playlists in the cache directory, so
+    that they can be served to clients (by ImageHandler) instead of each
+    client fetching them from YouTube.
+
+    Thumbnails are fetched in the background by prefetch(), for search
+    results, playlist items and browse listings, and by Video.audio_url when a
+    track is cached. They are fetched over a session of their own, whose
+    connections are kept open and shared by the background workers (or, with
+    http2, multiplexed over one connection). Thumbnails that can't
+    be fetched aren't tried again for 'retry_after' seconds.
+
+    If Pillow is installed, smaller variants of each thumbnail, one for each
+    of 'tiers' (name: width), are made when it is fetched, so that clients
+    showing small images don't have to download large ones. The thumbnail as
+    fetched is the "large" tier.
+    """
+
+    timeout = 10
+    retry_after = 3600
+    tiers = {"small": 120, "medium": 320}
+
+    def __init__(self, index, proxy=None, headers=None):
+        self.index = index
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2, pool_maxsize=workers.pools["background"]
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if comms.Client.http2:
+            self.session.mount("https://", comms.HTTPXAdapter(retries=2))
+        if proxy:
+            self.session.proxies.update({"http": proxy, "https": proxy})
+        if headers:
+            self.session.headers.update(headers)
+        self._lock = threading.Lock()
+        self._pending = set()
+        # ids whose thumbnail couldn't be fetched or resized
+        self._skipped = TTLCache(maxsize=1000, ttl=self.retry_after)
+
+    def find(self, id):
+        """
+        returns the filename of the cached thumbnail of 'id', or None
+        """
+        return self.index.find(id, image_formats)
+
+    def images(self, id):
+        """
+        returns the cached thumbnail of 'id', and its variants, as Images
+        (largest first), or None if it isn't cached
+        """
+        cached = self.find(id)
+        if not cached:
+            return None
+        return [Image(uri=f"/youtube/{cached}")] + [
+            Image(uri=f"/youtube/{variant}", width=self.tiers[tier])
+            for tier, variant in reversed(self.variants(id))
+        ]
+
+    def variants(self, id):
+        """
+        returns (tier, filename) of the cached variants of the thumbnail of
+        'id', smallest first
+        """
+        variants = []
+        for tier in sorted(self.tiers, key=self.tiers.get):
+            filename = self.index.find(id, [f"{tier}.jpg"])
+            if filename:
+                variants.append((tier, filename))
+        return variants
+
+    def prefetch(self, entries):
+        """
+        starts fetching, in the background, the thumbnails of those of
+        'entries' (videos or playlists) that aren't cached yet, and making the
+        variants of those that are cached without them
+        """
+        for entry in entries:
+            if self.find(entry.id) and (PIL is None or self.variants(entry.id)):
+                continue
+            with self._lock:
+                if entry.id in self._pending or entry.id in self._skipped:
+                    continue
+                self._pending.add(entry.id)
+            task = workers.submit(
+                "background", self._fetch, entry, priority=workers.PREFETCH
+            )
+            # also if it is dropped with the operation it was fetched for
+            task.add_done_callback(lambda _, id=entry.id: self._done(id))
+
+    def fetch(self, entry):
+        """
+        fetches the thumbnail of 'entry' now, unless it is cached already.
+        Returns the filename of the cached thumbnail, or None.
+        """
+        cached = self.find(entry.id)
+        if not cached:
+            return self._download(entry)
+        if PIL and not self.variants(entry.id):
+            self._make_variants(entry.id, cached)
+        return cached
+
+    def _fetch(self, entry):
+        try:
+            self.fetch(entry)
+        except Exception as e:
+            logger.debug(f"could not cache thumbnail of {entry.id}: {e}")
+
+    def _done(self, id):
+        with self._lock:
+            self._pending.discard(id)
+
+    def _download(self, entry):
+        images = entry.thumbnails.get(timeout=self.timeout) or []
+        # largest first; images without a size are the maxresdefault ones
+        images = sorted(images, key=lambda image: -(image.width or 10000))
+        for image in images:
+            response = self.session.get(image.uri, stream=True, timeout=self.timeout)
+            with response:
+                if response.status_code != 200:
+                    continue
+                chunks = response.iter_content(16384)
+                magic = next(chunks, b"")
+                ext = image_format(magic)
+                if not ext:
+                    logger.debug(
+                        f"invalid image format for {entry.id}; magic: {magic[:4]}"
+                    )
+                    continue
+                filename = f"{entry.id}.{ext}"
+                path = self.index.path(filename, create=True)
+                # written under another name first, so that ImageHandler never
+                # serves half an image
+                with open(f"{path}.part", "wb") as out_file:
+                    out_file.write(magic)
+                    for chunk in chunks:
+                        out_file.write(chunk)
+                os.replace(f"{path}.part", path)
+            self.index.add(filename)
+            logger.debug(f"cached thumbnail {filename}")
+            if PIL:
+                self._make_variants(entry.id, filename)
+            return filename
+
+        with self._lock:
+            self._skipped[entry.id] = True
+        return None
+
+    def _make_variants(self, id, filename):
+        """
+        makes the variants of a cached thumbnail that is wider than them
+        """
+        try:
+            with PIL.Image.open(self.index.path(filename)) as source:
+                image = source.convert("RGB")
+        except Exception as e:
+            # webp support, for one, depends on how Pillow was built
+            logger.debug(f"could not open {filename} to resize it: {e}")
+            with self._lock:
+                self._skipped[id] = True
+            return
+
+        # thumbnails that are already small have no variants
+        if image.width <= min(self.tiers.values()):
+            with self._lock:
+                self._skipped[id] = True
+
+        for tier, width in self.tiers.items():
+            if image.width <= width:
+                continue
+            variant = f"{id}.{tier}.jpg"
+            path = self.index.path(variant)
+            image.resize(
+                (width, round(image.height * width / image.width)),
+                PIL.Image.LANCZOS,
+            ).save(f"{path}.part", "JPEG", quality=85)
+            os.replace(f"{path}.part", path)
+            self.index.add(variant)
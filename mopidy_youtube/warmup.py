@@ -0,0 +1,180 @@
+import gzip
+import json
+import threading
+import time
+
+from mopidy.models import model_json_decoder
+
+from mopidy_youtube import logger, workers, youtube
+from mopidy_youtube.data import extract_video_id
+
+# the warm-up in progress, if there is one
+active = None
+
+
+class WarmUp:
+    """
+    Loads the tracks that Mopidy is about to restore (the tracklist and play
+    history it saved when it last stopped) before they are asked for, so that
+    restoring them doesn't mean fetching everything from YouTube at once.
+
+    Metadata is loaded from the metadata store first. The rest is then loaded
+    from YouTube in order of priority: the current track, the next_tracks
+    tracks after it, the rest of the tracklist and, lastly, the metadata of
+    the history_tracks most recently played tracks. There is at least
+    'interval' seconds between requests.
+    """
+
+    next_tracks = 3
+    history_tracks = 50
+    interval = 1.0
+    audio_url_timeout = 60
+
+    def __init__(self, tracklist_ids, history_ids=()):
+        # in order of priority
+        self.tracklist_ids = list(dict.fromkeys(tracklist_ids))
+        self.history_ids = [
+            id for id in dict.fromkeys(history_ids) if id not in self.tracklist_ids
+        ][: self.history_tracks]
+        self.done = threading.Event()
+        self._stopping = threading.Event()
+        self._ids = set(self.tracklist_ids)
+        self._last_request = 0
+
+    @classmethod
+    def from_state_file(cls, path):
+        """
+        returns a WarmUp for the youtube tracks in a Mopidy state file
+        (core/state.json.gz), or None if there aren't any
+        """
+        try:
+            with gzip.open(path, "rt") as state_file:
+                state = json.load(state_file, object_hook=model_json_decoder)["state"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"warm-up: could not read {path}: {e}")
+            return None
+
+        tl_tracks = state.tracklist.tl_tracks
+        current = next(
+            (
+                i
+                for i, tl_track in enumerate(tl_tracks)
+                if tl_track.tlid == state.playback.tlid
+            ),
+            0,
+        )
+        # the current track and those after it, then those before it
+        tracks = [
+            tl_track.track for tl_track in tl_tracks[current:] + tl_tracks[:current]
+        ]
+        history = [history_track.track for history_track in state.history.history]
+
+        warm_up = cls(
+            [id for id in map(cls._video_id, tracks) if id],
+            [id for id in map(cls._video_id, history) if id],
+        )
+        if not (warm_up.tracklist_ids or warm_up.history_ids):
+            return None
+        return warm_up
+
+    @staticmethod
+    def _video_id(track):
+        if track.uri.startswith("youtube:video:") or track.uri.startswith("yt:video:"):
+            return extract_video_id(track.uri)
+        return None
+
+    def covers(self, video_id):
+        """
+        whether the audio_url of 'video_id' is going to be resolved by this
+        warm-up, if it hasn't been already
+        """
+        return not self.done.is_set() and video_id in self._ids
+
+    def start(self):
+        global active
+        active = self
+        threading.Thread(target=self.run, name="YouTubeWarmUp", daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        global active
+        try:
+            self._run()
+        except Exception as e:
+            logger.error(f"warm-up error: {e}")
+        finally:
+            self.done.set()
+            if active is self:
+                active = None
+
+    def _run(self):
+        started = time.time()
+        videos = [
+            youtube.Video.get(id)
+            for id in self.tracklist_ids
+            if not youtube.Video.dead_reason(id)
+        ]
+        history = [
+            youtube.Video.get(id)
+            for id in self.history_ids
+            if not youtube.Video.dead_reason(id)
+        ]
+        minimum_fields = ["title", "length", "channel"]
+
+        # local stores first
+        remaining = set(
+            youtube.Video._load_stored_data(videos + history, minimum_fields)
+        )
+        local = len(videos) + len(history) - len(remaining)
+
+        # then youtube: metadata and audio urls of the current and next tracks,
+        # those of the rest of the tracklist, and metadata of the history
+        first = videos[: self.next_tracks + 1]
+        rest = videos[self.next_tracks + 1 :]
+        resolved = 0
+        # only the current and next tracks are needed soon; the rest waits
+        # behind other work (and, if it is being cached, is downloaded within
+        # download_ratelimit)
+        for batch, resolve, level in [
+            (first, True, workers.INTERACTIVE),
+            (rest, True, workers.PREFETCH),
+            (history, False, workers.PREFETCH),
+        ]:
+            with workers.priority(level):
+                todo = [video for video in batch if video in remaining]
+                for i in range(0, len(todo), 50):
+                    if self._wait():
+                        return
+                    youtube.Video.load_info(todo[i : i + 50])
+                if not resolve:
+                    continue
+                for video in batch:
+                    if video._audio_url is not None:
+                        continue
+                    if self._wait():
+                        return
+                    try:
+                        video.audio_url.get(timeout=self.audio_url_timeout)
+                        resolved += 1
+                    except Exception as e:
+                        logger.debug(f"warm-up: no audio_url for {video.id}: {e}")
+
+        logger.info(
+            f"warm-up finished in {time.time() - started:.1f}s: "
+            f"{len(videos)} queued and {len(history)} played tracks, "
+            f"{local} from the metadata store, {resolved} audio urls resolved"
+        )
+
+    def _wait(self):
+        """
+        waits until the next request is allowed; returns true if stopping
+        """
+        delay = self._last_request + self.interval - time.monotonic()
+        if self._stopping.wait(max(delay, 0)):
+            return True
+        self._last_request = time.monotonic()
+        return False
@@ -7,13 +7,18 @@ import tornado.gen
 import tornado.ioloop
 import tornado.web
 
-from mopidy_youtube import logger, youtube
+from mopidy_youtube import cachestats, logger, youtube
+from mopidy_youtube.cachedir import shard_path, split_filename
 from mopidy_youtube.data import extract_playlist_id, extract_video_id
 
 # from PIL import Image
 
 
 class ImageHandler(tornado.web.StaticFileHandler):
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        return os.path.abspath(shard_path(root, path))
+
     def get_cache_time(self, *args):
         return self.CACHE_MAX_AGE
 
@@ -54,7 +59,7 @@ class IndexHandler(tornado.web.RequestHandler):
         elif image is not None:
             ext = self.get_argument("ext")
             track = self.get_argument("track", None)
-            json_file = os.path.join(self.root, f"{image}.json")
+            json_file = shard_path(self.root, f"{image}.json")
 
             artists = ""
             album = ""
@@ -86,24 +91,29 @@ class IndexHandler(tornado.web.RequestHandler):
         for json_line in self.data_generator():
             yield (json_line[0]["comment"], json_line[0]["name"], json_line[2])
 
-    def data_generator(self):
-        images = [
-            os.path.basename(x) for x in glob.glob(os.path.join(self.root, "*.jpg"))
-        ] + [os.path.basename(x) for x in glob.glob(os.path.join(self.root, "*.webp"))]
+    def cache_entries(self):
+        """
+        returns (id, extensions) for everything in the cache, from the cache
+        index if the backend has built one
+        """
+        if youtube.cache_index:
+            return youtube.cache_index.entries()
 
-        json_files = glob.glob(os.path.join(self.root, "*.json"))
+        entries = {}
+        for filename in glob.glob(os.path.join(self.root, "*", "*")):
+            id, ext = split_filename(filename)
+            entries.setdefault(id, []).append(ext)
+        return entries.items()
 
+    def data_generator(self):
         combo = []
-        for filename in json_files:
-            # logger.info(f"{os.path.splitext(os.path.basename(filename))[0]}.jpg")
-            if f"{os.path.splitext(os.path.basename(filename))[0]}.jpg" in images:
-                combo.append(
-                    (filename, os.path.splitext(os.path.basename(filename))[0], "jpg")
-                )  # ,  self.find_dominant_color(os.path.join(self.root, f"{os.path.splitext(os.path.basename(filename))[0]}.jpg"))))
-            elif f"{os.path.splitext(os.path.basename(filename))[0]}.webp" in images:
-                combo.append(
-                    (filename, os.path.splitext(os.path.basename(filename))[0], "webp")
-                )  # ,  self.find_dominant_color(os.path.join(self.root, f"{os.path.splitext(os.path.basename(filename))[0]}.webp"))))
+        for id, exts in self.cache_entries():
+            if "json" not in exts:
+                continue
+            for ext in ("jpg", "webp"):
+                if ext in exts:
+                    combo.append((shard_path(self.root, f"{id}.json"), id, ext))
+                    break
 
         # for filename in sorted(combo, key=lambda element: (element[3][0], element[3][1], element[3][2])):
         for filename in combo:
@@ -119,6 +129,20 @@ class IndexHandler(tornado.web.RequestHandler):
     #     return dominant_color
 
 
+class StatsHandler(tornado.web.RequestHandler):
+    """
+    reports how the in-memory caches are doing, to help size them
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(
+            json.dumps(
+                {name: cache.stats() for name, cache in cachestats.caches.items()}
+            )
+        )
+
+
 class AudioHandler(tornado.web.RequestHandler):
     """Keep reading file until it is all read and written.
     Allows simultaneous downloading by youtube_dl and playback of file.
@@ -132,7 +156,7 @@ class AudioHandler(tornado.web.RequestHandler):
     def get(self, path):
         logger.debug(f"started serving {path} to gstreamer")
         total_bytes = youtube.Video.get(os.path.splitext(path)[0]).total_bytes
-        self.path = f"{self.cache_dir}/{path}"
+        self.path = shard_path(self.cache_dir, path)
         self.set_header("Content-Type", "application/octet-stream")
         self.set_header("Content-Length", total_bytes)
         self.flush()
@@ -0,0 +1,449 @@
+"""
+The threads that load things in the background, shared by everything.
+
+Work is submitted to one of a few pools, by purpose:
+ - "background": work that nobody waits for (loading the videos of
+   playlists, revalidating stale entries and browse listings, fetching
+   thumbnails)
+ - "load": loading the info of entries in batches (Video.load_info,
+   Playlist.load_info), and other work that fans out into requests
+ - "requests": single requests to YouTube, made in parallel by the apis
+
+Each pool has a fixed number of threads, so that a busy moment queues work
+rather than starting hundreds of threads, and so that the "requests" pool
+doesn't outgrow the connection pools of the sessions (10 connections per
+host, by default).
+
+Work in a pool only waits (through map) for work in the pools below it in
+'pools'; asked to wait for work in its own pool or one above it, map runs
+that work in the calling thread instead. That way a pool can't fill up with
+threads waiting for work that is queued behind them.
+
+Work also has a priority: PLAYBACK (what the track that is about to play
+needs), INTERACTIVE (what a client is waiting for) or PREFETCH (what may be
+needed later). Queued work is started in order of priority, and prefetching
+only ever takes up half of the threads of a pool, so that there are threads
+left for the rest. Work that is submitted runs with the priority it was
+submitted with, which is that of the code that submitted it unless another
+is given; code that isn't a worker is INTERACTIVE unless it says otherwise
+(see priority()).
+
+Work can be done for an operation, like a search or a browse (see
+operation()). Once an operation is superseded by a newer one, or has timed
+out, its work that no worker has started yet is dropped, so that the
+threads and connections it would take are left to the operations that are
+still wanted.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+
+from mopidy_youtube import comms
+
+PLAYBACK, INTERACTIVE, PREFETCH = range(3)
+
+# pool name: number of threads, from the top down
+pools = {"background": 4, "load": 4, "requests": 8}
+
+_pools = {}
+_lock = threading.Lock()
+_local = threading.local()
+# the latest operation in each context
+_operations = {}
+
+
+@contextmanager
+def priority(level):
+    """
+    work submitted in this block, in this thread, has priority 'level'
+    """
+    previous = getattr(_local, "priority", None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+@contextmanager
+def operation(context=None, timeout=None):
+    """
+    work submitted in this block, in this thread, is done for a new
+    operation, which supersedes the last one started in 'context' (if any),
+    and times out after 'timeout' seconds (if given). An operation started in
+    the block of another one is cancelled along with it.
+    """
+    previous = getattr(_local, "operation", None)
+    op = Operation(previous, timeout)
+    if context is not None:
+        with _lock:
+            superseded = _operations.get(context)
+            _operations[context] = op
+        if superseded is not None:
+            superseded.cancel()
+    _local.operation = op
+    try:
+        yield op
+    finally:
+        _local.operation = previous
+
+
+def current_priority():
+    level = getattr(_local, "priority", None)
+    return INTERACTIVE if level is None else level
+
+
+def configure(**sizes):
+    """
+    sets the number of threads of pools; pools that are already running
+    are replaced, once their queued work is done
+    """
+    with _lock:
+        for name, size in sizes.items():
+            if name not in pools:
+                raise ValueError(f"unknown worker pool {name}")
+            if size:
+                pools[name] = size
+                pool = _pools.pop(name, None)
+                if pool:
+                    pool.shutdown()
+
+
+def pool(name):
+    with _lock:
+        if name not in _pools:
+            _pools[name] = Pool(name, pools[name])
+        return _pools[name]
+
+
+def submit(name, fn, *args, priority=None, **kwargs):
+    """
+    runs fn(*args, **kwargs) in the pool 'name', with 'priority' (by default,
+    that of the caller). Returns a Task; waiting for it from a worker of the
+    same pool can deadlock, so use map, or Task.steal, for that.
+    """
+    task = Task(fn, args, kwargs, priority)
+    pool(name).put(task)
+    return task
+
+
+def map(name, fn, *iterables):
+    """
+    like Executor.map, but waits for all the calls to finish before
+    returning an iterator over their results (which raises the exception of
+    a call that failed when its result is reached). Calls that no worker
+    has started by the time they are waited for are made by the caller.
+    """
+    if _can_wait_for(name):
+        tasks = [Task(fn, args, {}) for args in zip(*iterables)]
+        for task in tasks:
+            # they are waited for right away, so they are needed even if
+            # the operation they are for is cancelled
+            task.droppable = False
+            pool(name).put(task)
+        for task in tasks:
+            task.steal()
+            task.exception()
+    else:
+        tasks = [_call_inline(fn, *args) for args in zip(*iterables)]
+    return (task.result() for task in tasks)
+
+
+def shutdown():
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(cancel=True)
+        _pools.clear()
+
+
+class Operation:
+    """
+    Something that work is done for (see operation())
+    """
+
+    def __init__(self, parent=None, timeout=None):
+        self.parent = parent
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        if self._cancelled:
+            return True
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return True
+        return self.parent is not None and self.parent.cancelled()
+
+
+class Task(Future):
+    """
+    A call submitted to a Pool, which can also be run by whoever needs its
+    result before a worker has got to it (see steal). It is made with the
+    priority (by default), freshness and operation of the code that created
+    the Task.
+    """
+
+    def __init__(self, fn, args, kwargs, priority=None):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = current_priority() if priority is None else priority
+        self.fresh = comms.is_fresh()
+        self.operation = getattr(_local, "operation", None)
+        # whether a worker drops the task if its operation has been
+        # cancelled by the time it gets to it
+        self.droppable = True
+        self._claimed = False
+        self._claim_lock = threading.Lock()
+
+    def superseded(self):
+        return (
+            self.droppable and self.operation is not None and self.operation.cancelled()
+        )
+
+    def steal(self):
+        """
+        runs the call in this thread, unless it has been started already. It
+        runs with the priority of this thread, if that is higher, and for the
+        operation of this thread, which needs it.
+        """
+        if self._claim():
+            self._run(
+                min(self.priority, current_priority()),
+                getattr(_local, "operation", None),
+            )
+
+    def drop(self):
+        """
+        cancels the call, unless it has been started already
+        """
+        with self._claim_lock:
+            if self._claimed:
+                return
+            self._claimed = True
+            # under the lock, so that done callbacks have been called by the
+            # time anyone trying to steal the task finds it cancelled
+            self.cancel()
+        self.fn = self.args = self.kwargs = None
+
+    def run(self):
+        if self._claim():
+            self._run(self.priority, self.operation)
+
+    def _claim(self):
+        with self._claim_lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def _run(self, priority, operation):
+        if not self.set_running_or_notify_cancel():
+            return
+        previous = getattr(_local, "priority", None), getattr(_local, "operation", None)
+        _local.priority, _local.operation = priority, operation
+        try:
+            # requests made for a caller that is in comms.fresh() bypass the
+            # response cache too
+            with comms.fresh() if self.fresh else nullcontext():
+                result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.set_exception(e)
+        else:
+            self.set_result(result)
+        finally:
+            _local.priority, _local.operation = previous
+            self.fn = self.args = self.kwargs = None
+
+
+class Pool:
+    """
+    A fixed number of threads, which run the Tasks put to them in order of
+    priority. No more than half of them run PREFETCH tasks at any time.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.prefetch_limit = max(1, size // 2)
+        self._queues = {level: deque() for level in (PLAYBACK, INTERACTIVE, PREFETCH)}
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        self._prefetching = 0
+        self._stopping = False
+
+    def put(self, task):
+        with self._condition:
+            self._queues[task.priority].append(task)
+            if self._idle == 0 and len(self._threads) < self.size:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"YouTube{self.name.capitalize()}-{len(self._threads)}",
+                    daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+
+    def queued(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def shutdown(self, cancel=False):
+        """
+        stops the threads once the queued tasks are done or, if 'cancel',
+        once the running ones are
+        """
+        with self._condition:
+            self._stopping = True
+            if cancel:
+                for queue in self._queues.values():
+                    while queue:
+                        queue.popleft().cancel()
+            self._condition.notify_all()
+
+    def _next(self):
+        """
+        returns the next task to run, or None once the pool is stopping and
+        there are no more
+        """
+        with self._condition:
+            while True:
+                for level in (PLAYBACK, INTERACTIVE):
+                    if self._queues[level]:
+                        return self._queues[level].popleft()
+                if self._queues[PREFETCH]:
+                    if self._prefetching < self.prefetch_limit:
+                        self._prefetching += 1
+                        return self._queues[PREFETCH].popleft()
+                elif self._stopping:
+                    return None
+                self._idle += 1
+                self._condition.wait()
+                self._idle -= 1
+
+    def _work(self):
+        _local.pool = self.name
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            try:
+                if task.superseded():
+                    task.drop()
+                else:
+                    task.run()
+            finally:
+                if task.priority == PREFETCH:
+                    with self._condition:
+                        self._prefetching -= 1
+                        self._condition.notify()
+
+
+class Batcher:
+    """
+    Gathers the items that concurrent callers of run() ask for into batches
+    of up to 'size' items, and calls fn(batch) once for each batch, so that
+    many callers asking for a few items each (eg the info of single videos)
+    share requests.
+
+    A batch is run as soon as it is full or, if it isn't, 'window' seconds
+    after its first item was added, by the caller that added that item. Full
+    batches are run in the pool 'pool'. A caller that has to wait for a batch
+    that hasn't started yet runs it itself, rather than waiting for a worker,
+    so that callers that are workers themselves can't deadlock the pool.
+    """
+
+    def __init__(self, fn, size=50, window=0.05, pool="load"):
+        self.fn = fn
+        self.size = size
+        self.window = window
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def run(self, items):
+        """
+        runs fn for all 'items', in batches shared with other callers, and
+        returns when that is done
+        """
+        batches = []
+        full = []
+        led = None
+        with self._lock:
+            for item in items:
+                if self._batch is None:
+                    self._batch = led = _Batch()
+                batch = self._batch
+                batch.items.append(item)
+                if not batches or batches[-1] is not batch:
+                    batches.append(batch)
+                if len(batch.items) >= self.size:
+                    batch.closed.set()
+                    full.append(batch)
+                    self._batch = None
+
+        for batch in full:
+            submit(self.pool, batch.run, self.fn)
+
+        if led is not None and not led.closed.wait(self.window):
+            # nobody filled it up in time
+            with self._lock:
+                if self._batch is led:
+                    self._batch = None
+                led.closed.set()
+
+        for batch in batches:
+            # other callers' batches are closed by them, within 'window'
+            batch.closed.wait()
+            batch.run(self.fn)
+            batch.done.wait()
+
+
+class _Batch:
+    __slots__ = ("items", "closed", "done", "_started", "_lock")
+
+    def __init__(self):
+        self.items = []
+        # set once no more items can be added
+        self.closed = threading.Event()
+        self.done = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def run(self, fn):
+        """
+        runs fn(items), unless that has been started already
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        try:
+            fn(self.items)
+        finally:
+            self.done.set()
+
+
+def _can_wait_for(name):
+    current = getattr(_local, "pool", None)
+    if current is None:
+        return True
+    order = list(pools)
+    return order.index(name) > order.index(current)
+
+
+def _call_inline(fn, *args):
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
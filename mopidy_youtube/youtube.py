@@ -1,41 +1,147 @@
 import importlib
 import json
 import os
-from concurrent.futures.thread import ThreadPoolExecutor
+import threading
+import time
+from contextlib import nullcontext
 
 import pykka
-from cachetools import TTLCache, cached
+from cachetools import TTLCache, keys
 from mopidy.models import Image, ModelJSONEncoder
 
-from mopidy_youtube import logger
+from mopidy_youtube import logger, resolver, workers
+from mopidy_youtube.cachedir import audio_formats
+from mopidy_youtube.cachestats import StatsTTLCache
+from mopidy_youtube.comms import fresh
 from mopidy_youtube.converters import convert_video_to_track
-from mopidy_youtube.data import extract_playlist_id, extract_video_id
+from mopidy_youtube.data import extract_expiry, extract_playlist_id, extract_video_id
 from mopidy_youtube.timeformat import ISO8601_to_seconds
 
 api_enabled = False
 channel = None
 cache_location = None
+cache_index = None
+thumbnail_cache = None
+# the downloads of tracks into the cache (see downloads.DownloadQueue)
+download_queue = None
+metadata_store = None
 musicapi_enabled = None
 musicapi_cookiefile = None
 youtube_dl = None
 youtube_dl_package = "youtube_dl"
+# where youtube_dl keeps the player scripts and signature functions it has
+# loaded, or None
+youtube_dl_cachedir = None
+
+
+def stored_together():
+    """
+    what is saved to the metadata store in this block, in this thread, is
+    written in one transaction (see MetadataStore.batch)
+    """
+    return metadata_store.batch() if metadata_store else nullcontext()
+
+
+def import_youtube_dl():
+    global youtube_dl
+    if youtube_dl is None:
+        logger.debug(f"using {youtube_dl_package} package for youtube_dl")
+        youtube_dl = importlib.import_module(youtube_dl_package)
+    return youtube_dl
+
+
+class Field:
+    """
+    The value of a field of an Entry, which may still be loading.
+
+    A Field can be used like the pykka.ThreadingFuture it stands in for
+    (set() once, get() blocks until then), but it only creates a future when
+    someone actually has to wait for it. Most fields are set before anyone
+    asks for them, and a future (with its queue and locks) costs far more
+    memory than the value it holds.
+    """
+
+    __slots__ = ("_value", "_loaded", "_future", "fetched_at", "_dropped")
+
+    # creating and setting the future of a field happens under this lock;
+    # it's held very briefly, and only for fields that are waited for
+    _lock = threading.Lock()
+
+    # (entry, name, task) of the queued workers.Tasks that will set fields,
+    # by field (see Entry._load_in_background)
+    loaders = {}
+
+    def __init__(self):
+        self._loaded = False
+        self._future = None
+        # when the value was fetched, for Entry.field_ttls
+        self.fetched_at = None
+        # (entry, name) of an unset field whose loader was dropped
+        self._dropped = None
+
+    def is_set(self):
+        return self._loaded
+
+    def set(self, value=None):
+        """
+        sets the value, and wakes up anyone waiting for it. Like a future, a
+        field is only set once; later values are ignored.
+        """
+        with Field._lock:
+            if self._loaded:
+                return
+            self._value = value
+            self._loaded = True
+            future, self._future = self._future, None
+        if future is not None:
+            future.set(value)
+
+    def get(self, timeout=None):
+        if self._loaded:
+            return self._value
+        # rather than wait for a worker to get round to loading it
+        loader = Field.loaders.get(self)
+        if loader is not None:
+            entry, k, task = loader
+            task.steal()
+            dropped = (entry, k) if task.cancelled() else None
+        else:
+            # the loader may have been dropped since this field was taken
+            # (Entry._loader_done notes that before it forgets the loader)
+            dropped = self._dropped
+        if dropped is not None:
+            # dropped with the operation it was loaded for; it is loaded
+            # again for this one
+            entry, k = dropped
+            self.set(getattr(entry, k).get(timeout=timeout))
+        with Field._lock:
+            if self._loaded:
+                return self._value
+            if self._future is None:
+                self._future = pykka.ThreadingFuture()
+            future = self._future
+        return future.get(timeout=timeout)
 
 
 def async_property(func):
     """
-    decorator for creating async properties using pykka.ThreadingFuture
+    decorator for creating async properties using Field
 
-    A property 'foo' should have a future '_foo'
-    On first call we invoke func() which should create the future
-    On subsequent calls we just return the future
+    A property 'foo' should have a Field '_foo'
+    On first call we invoke func() which should create the Field
+    On subsequent calls we just return the Field, and start loading it
+    again in the background if it is stale (see Entry.field_ttls)
     """
 
-    _future_name = "_" + func.__name__
+    _field_name = "_" + func.__name__
 
     def wrapper(self):
-        if _future_name not in self.__dict__:
-            func(self)  # should create the future
-        return self.__dict__[_future_name]
+        field = getattr(self, _field_name)
+        if field is None:
+            func(self)  # should create the Field
+            return getattr(self, _field_name)
+        self._revalidate_if_stale(func.__name__, field)
+        return field
 
     return property(wrapper)
 
@@ -62,18 +168,87 @@ class Entry:
     cache_max_len = 4000
     cache_ttl = 21600
 
-    cache = TTLCache(maxsize=cache_max_len, ttl=cache_ttl)
+    # the kind of entry, as recorded in the metadata store
+    kind = None
+
+    # entries that haven't been used for cache_ttl seconds are dropped; the
+    # fields of entries that are in use are kept fresh according to field_ttls.
+    # The size and ttl can be configured (see YouTubeBackend)
+    cache = StatsTTLCache("entries", maxsize=cache_max_len, ttl=cache_ttl)
+    cache_lock = threading.Lock()
+
+    # held while the Fields of entries are added (see _add_futures)
+    fields_lock = threading.Lock()
+
+    # how long (in seconds) each field stays fresh. A stale value is still
+    # returned straight away, but it is loaded again in the background.
+    # Fields that aren't listed here never go stale.
+    field_ttls = {
+        "title": 7 * 86400,
+        "channel": 7 * 86400,
+        "channelId": 30 * 86400,
+        "owner_channel": 7 * 86400,
+        "length": 30 * 86400,
+        "thumbnails": 7 * 86400,
+        "album": 7 * 86400,
+        "artists": 7 * 86400,
+        "track_no": 7 * 86400,
+        "video_count": 3600,
+        "videos": 3600,
+    }
+
+    # stale fields that are waiting to be loaded again, as {entry: {k: (field,
+    # fetched_at)}}, by the task that _revalidate_if_stale started for them
+    stale_fields = {}
+    stale_fields_lock = threading.Lock()
+
+    # search results, as (kind, id) pairs, keyed on the normalised query, the
+    # api in use and the number of results
+    search_cache_max_len = 500
+    search_cache_ttl = 900
+
+    search_cache = StatsTTLCache(
+        "searches", maxsize=search_cache_max_len, ttl=search_cache_ttl
+    )
+    search_cache_lock = threading.Lock()
+
+    # Entries keep their fields in slots rather than in a __dict__, since
+    # thousands of them are cached. A field that hasn't been asked for (or
+    # has been dropped, so that it is loaded again) is None.
+    __slots__ = (
+        "id",
+        "_title",
+        "_channel",
+        "_channelId",
+        "_owner_channel",
+        "_thumbnails",
+        "_album",
+        "_artists",
+        "_track_no",
+        "_length",
+        "_video_count",
+    )
+
+    def __init__(self):
+        self.id = None
+        for name in Entry.__slots__[1:]:
+            setattr(self, name, None)
 
     @classmethod
-    @cached(cache=cache)
     def get(cls, id):
         """
         Use Video.get(id), Playlist.get(id), instead of Video(id), Playlist(id),
         to fetch a cached object, if available
         """
 
-        obj = cls()
-        obj.id = id
+        key = keys.hashkey(cls, id)
+        with Entry.cache_lock:
+            obj = Entry.cache.get(key)
+            if obj is None:
+                obj = cls()
+                obj.id = id
+            # (re)inserting restarts the ttl, so entries in use stay cached
+            Entry.cache[key] = obj
         return obj
 
     @classmethod
@@ -99,7 +274,22 @@ class Entry:
         length and video_count. The official youtube API will require an
         additional API call to fetch length and video_count (taken care of
         at Video.load_info and Playlist.load_info).
+
+        Repeated searches are answered from Entry.search_cache, as long as
+        all the entries found are still in Entry.cache.
         """
+        search_key = cls._search_key(q)
+        with Entry.search_cache_lock:
+            cached_entries = Entry.search_cache.get(search_key)
+            entries = cached_entries and cls._cached_search_entries(cached_entries)
+            if cached_entries and not entries:
+                # some of its entries have expired, so it's no use after all
+                Entry.search_cache.hits -= 1
+                Entry.search_cache.misses += 1
+        if entries:
+            logger.debug(f"search cache hit for {q}")
+            return entries
+
         try:
             data = cls.api.search(q)
             if "error" in data:
@@ -108,27 +298,188 @@ class Entry:
             logger.error('youtube search error "%s"', e)
             return None
         try:
-            return list(map(cls.create_object, data["items"]))
+            with stored_together():
+                entries = list(map(cls.create_object, data["items"]))
         except Exception as e:
             logger.error('map error "%s"', e)
             return None
 
+        if entries:
+            with Entry.search_cache_lock:
+                Entry.search_cache[search_key] = [
+                    (entry.kind, entry.id) for entry in entries if entry
+                ]
+        return entries
+
+    @classmethod
+    def _search_key(cls, q):
+        return (
+            " ".join(q.lower().split()),
+            type(cls.api).__name__,
+            getattr(Video, "search_results", None),
+        )
+
+    @classmethod
+    def _cached_search_entries(cls, cached_entries):
+        """
+        rebuilds a cached search result from Entry.cache; returns None if any
+        of the entries has expired
+        """
+        kinds = {"video": Video, "playlist": Playlist}
+        entries = []
+        for kind, id in cached_entries:
+            with Entry.cache_lock:
+                if keys.hashkey(kinds[kind], id) not in Entry.cache:
+                    return None
+            entries.append(kinds[kind].get(id))
+        return entries
+
     @classmethod
     def _add_futures(cls, futures_list, fields):
         """
-        Adds futures for the given fields to all objects in list, unless they
-        already exist. Returns objects for which at least one future was added
+        Adds Fields for the given fields to all objects in list, unless they
+        already exist. Returns objects for which at least one Field was added
         """
 
         def add(obj):
             added = False
             for k in fields:
-                if "_" + k not in obj.__dict__:
-                    obj.__dict__["_" + k] = pykka.ThreadingFuture()
+                if getattr(obj, "_" + k) is None:
+                    setattr(obj, "_" + k, Field())
                     added = True
             return added
 
-        return list(filter(add, futures_list))
+        # so that, of concurrent callers, only one loads each field
+        with cls.fields_lock:
+            return list(filter(add, futures_list))
+
+    @classmethod
+    def _load_stored_data(cls, listOfEntries, fields):
+        """
+        sets the fields of entries that are available from the metadata store.
+        Returns the entries that still need to be loaded through the API
+        """
+        if not (metadata_store and listOfEntries):
+            return listOfEntries
+
+        try:
+            stored = metadata_store.load(cls.kind, [x.id for x in listOfEntries])
+        except Exception as e:
+            logger.error(f"metadata store load error {e}")
+            return listOfEntries
+
+        remaining = []
+        for entry in listOfEntries:
+            values = stored.get(entry.id, {})
+            if all(k in values for k in fields):
+                entry._set_stored_data(values)
+            else:
+                remaining.append(entry)
+        return remaining
+
+    def _set_stored_data(self, values):
+        """
+        sets the fields of 'self' from {field: (value, fetched_at)}, as
+        loaded from the metadata store
+        """
+
+        for k, (val, fetched_at) in values.items():
+            self._set_field(k, val, fetched_at)
+
+    def _set_field(self, k, val, fetched_at=None, replace=False):
+        """
+        sets field 'k' of 'self' to 'val', fetched at 'fetched_at' (or now).
+        A field that has already been set is left alone, unless 'replace' is
+        true, in which case it gets a new Field, so that anyone holding the
+        old one still gets the old value. Returns whether the field was set.
+        """
+        _k = "_" + k
+        field = getattr(self, _k)
+        if field is not None and field.is_set():
+            if not replace:
+                return False
+            field = Field()
+        elif field is None:
+            field = Field()
+        field.fetched_at = fetched_at or time.time()
+        field.set(val)
+        setattr(self, _k, field)
+        return True
+
+    def _load_in_background(self, k, fn, *args):
+        """
+        has fn(*args), which sets the field 'k', run by the background
+        workers. If the field is waited for before a worker has started on
+        it, fn is run by whoever waits for it instead. If the operation it is
+        loaded for is cancelled first, the field is unset, to be loaded again
+        when it is next asked for.
+        """
+        field = getattr(self, "_" + k)
+        task = workers.submit("background", fn, *args)
+        Field.loaders[field] = (self, k, task)
+        task.add_done_callback(lambda task: self._loader_done(k, field, task))
+
+    def _loader_done(self, k, field, task):
+        if task.cancelled():
+            # so that whoever already holds the field loads it again
+            field._dropped = (self, k)
+            with self.fields_lock:
+                if getattr(self, "_" + k) is field and not field.is_set():
+                    setattr(self, "_" + k, None)
+        Field.loaders.pop(field, None)
+
+    def _revalidate_if_stale(self, k, field):
+        ttl = self.field_ttls.get(k)
+        fetched_at = field.fetched_at
+        if ttl is None or fetched_at is None or time.time() - fetched_at < ttl:
+            return
+
+        # stale: note it as fresh, so that it is only loaded again once
+        logger.debug(f"{k} of {self.id} is stale, loading it again")
+        field.fetched_at = time.time()
+        # the stale fields of all the entries that are asked for before a
+        # worker gets to them (eg those of a browsed playlist) are loaded
+        # together
+        with Entry.stale_fields_lock:
+            start = not Entry.stale_fields
+            Entry.stale_fields.setdefault(self, {})[k] = (field, fetched_at)
+        if start:
+            task = workers.submit(
+                "background", Entry._revalidate, priority=workers.PREFETCH
+            )
+            task.add_done_callback(Entry._revalidation_done)
+
+    @staticmethod
+    def _revalidate():
+        """
+        loads the stale fields in Entry.stale_fields again. See Video.refresh,
+        Playlist.refresh
+        """
+        with Entry.stale_fields_lock:
+            stale, Entry.stale_fields = Entry.stale_fields, {}
+        groups = {}
+        for entry, fields in stale.items():
+            key = (type(entry), tuple(sorted(fields)))
+            groups.setdefault(key, []).append(entry)
+        for (cls, fields), entries in groups.items():
+            try:
+                with fresh():
+                    cls.refresh(entries, fields)
+            except Exception as e:
+                logger.error(
+                    f"error loading {fields} of {len(entries)} entries again: {e}"
+                )
+
+    @staticmethod
+    def _revalidation_done(task):
+        if not task.cancelled():
+            return
+        # stale again, for the next operation that asks for them
+        with Entry.stale_fields_lock:
+            stale, Entry.stale_fields = Entry.stale_fields, {}
+        for fields in stale.values():
+            for field, fetched_at in fields.values():
+                field.fetched_at = fetched_at
 
     @async_property
     def title(self):
@@ -142,19 +493,18 @@ class Entry:
     def channelId(self):
         self.load_info([self])
 
-    def _set_api_data(self, fields, item):
+    def _set_api_data(self, fields, item, persist=True, replace=False):
         """
         sets the given 'fields' of 'self', based on the 'item'
-        data retrieved through the API
+        data retrieved through the API. Unless 'persist' is false, the
+        values are also written to the metadata store, if there is one.
+        Fields that have already been set are only changed if 'replace'.
         """
 
+        values = {}
         for k in fields:
-            _k = "_" + k
-            future = self.__dict__.get(_k)
-            if not future:
-                future = self.__dict__[_k] = pykka.ThreadingFuture()
-
-            if not future._queue.empty():  # hack, no public is_set()
+            field = getattr(self, "_" + k)
+            if field is not None and field.is_set() and not replace:
                 continue
 
             if not item:
@@ -191,7 +541,15 @@ class Entry:
                 val = item["snippet"]["channelId"]
             elif k == "track_no":
                 val = item["track_no"]
-            future.set(val)
+            self._set_field(k, val, replace=replace)
+            if val is not None:
+                values[k] = val
+
+        if persist and values and metadata_store and self.kind:
+            try:
+                metadata_store.save(self.kind, self.id, values)
+            except Exception as e:
+                logger.error(f"metadata store save error {e} ({self.id})")
 
     @classmethod
     def extend_fields(self, item, fields):
@@ -237,25 +595,108 @@ class Entry:
 
 
 class Video(Entry):
-    total_bytes = 0
+    kind = "video"
+
+    __slots__ = ("_related_videos", "_audio_url", "total_bytes", "audio_url_expiry")
+
+    # videos that are known to be unplayable (private, deleted, etc), and why;
+    # kept separately from Entry.cache, so that they are not looked up again
+    # every time the Video object is dropped from it
+    dead_cache_max_len = 10000
+    dead_cache_ttl = 86400
+
+    dead_cache = TTLCache(maxsize=dead_cache_max_len, ttl=dead_cache_ttl)
+    dead_cache_lock = threading.Lock()
+
+    # youtube_dl errors that mean the video will never be playable. Not
+    # "Video unavailable" on its own, which is also what yt-dlp says while it
+    # is being rate limited.
+    dead_reasons = (
+        "Private video",
+        "video is private",
+        "has been removed",
+        "account associated with this video has been terminated",
+        "copyright",
+    )
+
+    # stream urls from youtube_dl stop working after a few hours; they are
+    # resolved again when they are this close (in seconds) to expiring
+    audio_url_expiry_margin = 600
+    audio_url_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__()
+        self._related_videos = None
+        self._audio_url = None
+        self.total_bytes = 0
+        self.audio_url_expiry = None
+
+    @classmethod
+    def mark_dead(cls, id, reason):
+        logger.debug(f"marking video {id} as unplayable: {reason}")
+        with cls.dead_cache_lock:
+            cls.dead_cache[id] = reason
+
+    @classmethod
+    def uncache(cls, id):
+        """
+        called when the cached files of a video are evicted, so that its
+        audio_url doesn't point to a file that has gone
+        """
+        key = keys.hashkey(cls, id)
+        with Entry.cache_lock:
+            # not get(), so as not to count as a lookup
+            video = Entry.cache[key] if key in Entry.cache else None
+        if video:
+            with cls.audio_url_lock:
+                video._audio_url = None
+                video.total_bytes = 0
+
+    @classmethod
+    def dead_reason(cls, id):
+        """
+        returns the reason a video is known to be unplayable, or None
+        """
+        with cls.dead_cache_lock:
+            return cls.dead_cache.get(id)
 
     @classmethod
     def load_info(cls, listOfVideos):
         """
         loads title, length, channel of multiple videos using one API call for
-        every 50 videos. API calls are split in separate threads.
+        every 50 videos. API calls are split in separate threads, and shared
+        with other callers of load_info (see info_batcher).
         """
         minimum_fields = ["title", "length", "channel"]
         listOfVideos = cls._add_futures(listOfVideos, minimum_fields)
 
-        def job(sublist):
-            try:
-                data = cls.api.list_videos([x.id for x in sublist])
-                item_dict = {item["id"]: item for item in data["items"]}
-            except Exception as e:
-                logger.error('list_videos error "%s"', e)
-                item_dict = {}
+        # don't go looking for videos that are known to be unplayable
+        alive = []
+        for video in listOfVideos:
+            reason = cls.dead_reason(video.id)
+            if reason:
+                video._set_unplayable(minimum_fields)
+            else:
+                alive.append(video)
+        listOfVideos = cls._load_stored_data(alive, minimum_fields)
+        cls.info_batcher.run(listOfVideos)
+
+    @classmethod
+    def _load_batch(cls, sublist):
+        """
+        loads the info of up to 50 videos using one API call
+        """
+        minimum_fields = ["title", "length", "channel"]
+        try:
+            data = cls.api.list_videos([x.id for x in sublist])
+            item_dict = {item["id"]: item for item in data["items"]}
+            listed = True
+        except Exception as e:
+            logger.error('list_videos error "%s"', e)
+            item_dict = {}
+            listed = False
 
+        with stored_together():
             for video in sublist:
                 try:
                     extended_item = cls.extend_fields(
@@ -267,22 +708,61 @@ class Video(Entry):
                         f"Error {e} setting api data for {video.id}; "
                         f"probably private or deleted"
                     )
-                    error_dict = {
-                        "contentDetails": {"duration": "PT0S"},
-                        "id": video.id,
-                        "snippet": {
-                            "channelTitle": "Video unplayable",
-                            "title": "Video unplayable",
-                        },
-                    }
-                    video._set_api_data(minimum_fields, error_dict)
-
-        with ThreadPoolExecutor() as executor:
-            # make sure order is deterministic so that HTTP requests are replayable in tests
-            executor.map(
-                job,
-                [listOfVideos[i : i + 50] for i in range(0, len(listOfVideos), 50)],
-            )
+                    # only if the API answered, but without the video
+                    if listed:
+                        cls.mark_dead(video.id, "private or deleted")
+                    video._set_unplayable(minimum_fields)
+
+    @classmethod
+    def refresh(cls, listOfVideos, fields=()):
+        """
+        loads the info (and 'fields', if the api has them) of videos again
+        (see Entry.field_ttls), replacing what is already known, using one API
+        call for every 50 videos, shared with other callers of refresh (see
+        refresh_batcher). If the videos can't be loaded, they keep their
+        current info.
+        """
+        cls.refresh_batcher.run(
+            [(x, tuple(fields)) for x in listOfVideos if not cls.dead_reason(x.id)]
+        )
+
+    @classmethod
+    def _refresh_batch(cls, sublist):
+        """
+        loads the info of up to 50 (video, fields) again using one API call
+        """
+        minimum_fields = ["title", "length", "channel"]
+        ids = list(dict.fromkeys(video.id for video, fields in sublist))
+        try:
+            data = cls.api.list_videos(ids)
+            item_dict = {item["id"]: item for item in data["items"]}
+        except Exception as e:
+            logger.error(f"error loading {len(ids)} videos again: {e}")
+            return
+
+        with stored_together():
+            for video, fields in sublist:
+                if video.id not in item_dict:
+                    continue
+                item, extended_fields = cls.extend_fields(
+                    item_dict[video.id], minimum_fields
+                )
+                # only the fields that the api in use returns
+                wanted = set(minimum_fields).union(fields)
+                video._set_api_data(
+                    [k for k in extended_fields if k in wanted], item, replace=True
+                )
+
+    def _set_unplayable(self, fields):
+        error_dict = {
+            "contentDetails": {"duration": "PT0S"},
+            "id": self.id,
+            "snippet": {
+                "channelTitle": "Video unplayable",
+                "title": "Video unplayable",
+            },
+        }
+        self._set_api_data(fields, error_dict, persist=False)
 
     @async_property
     def related_videos(self):
@@ -299,15 +779,16 @@ class Video(Entry):
             relatedvideos = []
             data = self.api.list_related_videos(self.id)
 
-            for item in data["items"]:
-                # why are some results returned without a 'snippet'?
-                if "snippet" in item:
-                    minimum_fields = ["title", "channel"]
-                    item, extended_fields = self.extend_fields(item, minimum_fields)
-                    # extended_fields = minimum_fields
-                    video = Video.get(item["id"]["videoId"])
-                    video._set_api_data(extended_fields, item)
-                    relatedvideos.append(video)
+            with stored_together():
+                for item in data["items"]:
+                    # why are some results returned without a 'snippet'?
+                    if "snippet" in item:
+                        minimum_fields = ["title", "channel"]
+                        item, extended_fields = self.extend_fields(item, minimum_fields)
+                        # extended_fields = minimum_fields
+                        video = Video.get(item["id"]["videoId"])
+                        video._set_api_data(extended_fields, item)
+                        relatedvideos.append(video)
 
             # start loading video info in the background
             Video.load_info(relatedvideos)
@@ -323,11 +804,28 @@ class Video(Entry):
         requiresThumbnail = self._add_futures([self], ["thumbnails"])
 
         if requiresThumbnail:
+            # the sizes youtube makes of every thumbnail, largest first
+            # (maxresdefault is only there if the video is at least 720p)
+            video_id = self.id.split(":")[-1]
             self._thumbnails.set(
                 [
                     Image(
-                        uri=f"https://i.ytimg.com/vi_webp/{self.id.split(':')[-1]}/maxresdefault.webp"
+                        uri=f"https://i.ytimg.com/vi_webp/{video_id}/maxresdefault.webp",
+                        width=1280,
+                        height=720,
+                    )
+                ]
+                + [
+                    Image(
+                        uri=f"https://i.ytimg.com/vi/{video_id}/{name}.jpg",
+                        width=width,
+                        height=height,
                     )
+                    for name, width, height in [
+                        ("hqdefault", 480, 360),
+                        ("mqdefault", 320, 180),
+                        ("default", 120, 90),
+                    ]
                 ]
             )
 
@@ -372,26 +870,179 @@ class Video(Entry):
                 [{"name": self.channel.get(), "uri": None, "thumbnail": None}]
             )
 
+    def audio_url_stale(self):
+        """
+        whether audio_url has been resolved to a stream url that has expired,
+        or is about to
+        """
+        # audio_url_expiry is only set together with the stream url
+        return (
+            self._audio_url is not None
+            and self.audio_url_expiry is not None
+            and self.audio_url_expiry - time.time() < self.audio_url_expiry_margin
+        )
+
+    def refresh_audio_url(self):
+        """
+        resolves audio_url again, if it is stale (or, if the track is still
+        to be downloaded into the cache, moves it up the download queue).
+        Returns the audio_url future.
+        """
+        with self.audio_url_lock:
+            if self.audio_url_stale():
+                logger.debug(f"audio_url for {self.id} is stale, resolving again")
+                self._audio_url = None
+                self.audio_url_expiry = None
+        if download_queue:
+            # the track is about to be played
+            download_queue.hurry(self.id, workers.current_priority())
+        return self.audio_url
+
+    @classmethod
+    def youtube_dl_options(cls):
+        """
+        returns the options of the YoutubeDL instances that resolve
+        audio_url (see resolver)
+        """
+        ytdl_options = {
+            "format": "bestaudio/ogg/mp3/m4a/best",
+            "proxy": cls.proxy,
+            "cachedir": str(youtube_dl_cachedir) if youtube_dl_cachedir else False,
+            "nopart": True,
+            "retries": 10,
+        }
+        if musicapi_cookiefile:
+            ytdl_options["cookiefile"] = musicapi_cookiefile
+        if youtube_dl_package == "yt_dlp":
+            ytdl_options["no_color"] = True
+        return ytdl_options
+
     @async_property
     def audio_url(self):
         """
         audio_url is the only property retrived using youtube_dl, it's much more
         expensive than the rest. If caching is turned on and the track is cached,
         return a (file) url pointing to the cached file. If caching is turned on, and
-        the track isn't cached, start caching it, and - once 2 percent has been
-        cached - return a (http) url pointing to the cached file. If caching is not
-        turned on, return a url obtained with youtube_dl.
+        the track isn't cached, queue it for caching (see download), and - once 2
+        percent has been cached - return a (http) url pointing to the cached file.
+        If caching is not turned on, return a url obtained with youtube_dl.
         """
 
-        global youtube_dl
-        if youtube_dl is None:
-            logger.debug(f"using {youtube_dl_package} package for youtube_dl")
-            youtube_dl = importlib.import_module(youtube_dl_package)
+        import_youtube_dl()
+
+        requiresUrl = self._add_futures([self], ["audio_url"])
+        if requiresUrl and self.dead_reason(self.id):
+            logger.debug(f"not resolving unplayable video {self.id}")
+            self._audio_url.set(None)
+            return
+
+        if requiresUrl:
+            try:
+                ytdl_options = self.youtube_dl_options()
+                ytdl_extract_info_options = self._extract_info_options()
+
+                if cache_location:
+                    cached = cache_index.find(self.id, audio_formats)
+                    if cached:
+                        self._audio_url.set(f"file://{cache_index.path(cached)}")
+                        self._cache_extras()
+                    elif download_queue:
+                        # audio_url is set by the download (see download)
+                        download_queue.put(
+                            self.id, workers.current_priority(), video=self
+                        )
+                    else:
+                        self._download(ytdl_options, ytdl_extract_info_options)
+                elif resolver.processes:
+                    url = resolver.resolve(
+                        youtube_dl_package,
+                        ytdl_options,
+                        ytdl_extract_info_options["url"],
+                    )
+                    self.audio_url_expiry = extract_expiry(url)
+                    self._audio_url.set(url)
+                else:
+                    with resolver.instance(youtube_dl, ytdl_options) as ydl:
+                        info = ydl.extract_info(
+                            **ytdl_extract_info_options,
+                            download=False,
+                        )
+
+                        self.audio_url_expiry = extract_expiry(info["url"])
+                        self._audio_url.set(info["url"])
+
+            except Exception as e:
+                self._audio_url_failed(e)
+                return
+
+    def _audio_url_failed(self, e):
+        logger.error(f"audio_url error {e} (videoId: {self.id})")
+        if any(reason in str(e) for reason in self.dead_reasons):
+            self.mark_dead(self.id, str(e))
+        self._audio_url.set(None)
+
+    def _extract_info_options(self):
+        base_url = "https://www.youtube.com"
+        if musicapi_enabled:
+            # High quality music streams are only available to YouTube
+            # Premium users when using YouTube Music.
+            base_url = "https://music.youtube.com"
+
+        return {
+            "url": f"{base_url}/watch?v={self.id}",
+            "ie_key": None,
+            "extra_info": {},
+            "process": True,
+            "force_generic_extractor": False,
+        }
+
+    @classmethod
+    def download(cls, id, videos=()):
+        """
+        downloads the audio of video 'id' into the cache, for download_queue.
+        The audio_url of the last of 'videos' (the ones that asked for it) is
+        set once enough of it has been downloaded to start playing it, and
+        those of the others once it is done. A download resumed from the
+        state file, which no video has asked for yet, is for the video in the
+        cache now.
+        """
+        video = videos[-1] if videos else cls.get(id)
+        video._add_futures([video], ["audio_url"])
+        try:
+            if cls.dead_reason(id):
+                video._audio_url.set(None)
+                return
+            cached = cache_index.find(id, audio_formats)
+            if cached:
+                video._audio_url.set(f"file://{cache_index.path(cached)}")
+                return
+            import_youtube_dl()
+            try:
+                video._download(
+                    video.youtube_dl_options(), video._extract_info_options()
+                )
+            except Exception as e:
+                video._audio_url_failed(e)
+        finally:
+            # the earlier ones were evicted from the entry cache before the
+            # video was asked for again
+            url = video._audio_url.get() if video._audio_url.is_set() else None
+            for other in list(videos):
+                if other is not video and other._audio_url is not None:
+                    other._audio_url.set(url)
+
+    def _download(self, ytdl_options, ytdl_extract_info_options):
+        """
+        downloads the audio into the cache, in this thread
+        """
 
         # When caching, is it possible to set the audio_url part-way through
         # a download so audio can start playing quicker?
 
         def my_hook(d):
+            if d["status"] == "finished":
+                cache_index.add(d["filename"])
+
             if d["status"] == "finished" and not self.total_bytes:
                 fileUri = (
                     # if it is finished, don't need to serve it up with tornado...
@@ -440,154 +1091,82 @@ class Video(Entry):
                     )
                     self._audio_url.set(httpUri)
 
-        requiresUrl = self._add_futures([self], ["audio_url"])
-        if requiresUrl:
-            try:
-                ytdl_options = {
-                    "format": "bestaudio/ogg/mp3/m4a/best",
-                    "proxy": self.proxy,
-                    "cachedir": False,
-                    "nopart": True,
-                    "retries": 10,
-                }
-                if musicapi_cookiefile:
-                    ytdl_options["cookiefile"] = musicapi_cookiefile
-                base_url = "https://www.youtube.com"
-                if musicapi_enabled:
-                    # High quality music streams are only available to YouTube
-                    # Premium users when using YouTube Music.
-                    base_url = "https://music.youtube.com"
-
-                if youtube_dl_package == "yt_dlp":
-                    ytdl_options["no_color"] = True
-
-                ytdl_extract_info_options = {
-                    "url": f"{base_url}/watch?v={self.id}",
-                    "ie_key": None,
-                    "extra_info": {},
-                    "process": True,
-                    "force_generic_extractor": False,
-                }
-
-                if cache_location:
-                    info = {}
-                    cached = [
-                        cached_file
-                        for cached_file in os.listdir(cache_location)
-                        if cached_file
-                        in [
-                            f"{self.id}.{format}"
-                            for format in ["webm", "m4a", "mp3", "ogg"]
-                        ]
-                    ]
-                    if cached:
-                        fileUri = f"file://{(os.path.join(cache_location, cached[0]))}"
-                        self._audio_url.set(fileUri)
-                    else:
-                        logger.debug(f"caching track {self.id}")
-                        ytdl_options["outtmpl"] = os.path.join(
-                            cache_location, "%(id)s.%(ext)s"
-                        )
-
-                        ytdl_options["progress_hooks"] = [my_hook]
-
-                        with youtube_dl.YoutubeDL(ytdl_options) as ydl:
-                            info = ydl.extract_info(
-                                **ytdl_extract_info_options,
-                                download=True,
-                            )
-
-                            # get info about audio format, for debugging
-                            logger.debug(
-                                {
-                                    "format_id": info["format_id"],
-                                    "format_note": info["format_note"],
-                                    "bitrate": info["abr"],
-                                    "audio_ext": info["audio_ext"],
-                                }
-                            )
-
-                        # # self._audio_url.set is now done by the progress_hooks
-                        # fileUri = f"file://{ydl.prepare_filename(info)}"
-                        # self._audio_url.set(fileUri)
-
-                    # moved this here, because sometimes the image might go
-                    # missing, even if the audio and the json do not
-                    # and updated to account for jpgs and webps
-                    if not any(
-                        image in os.listdir(cache_location)
-                        for image in (f"{self.id}.webp", f"{self.id}.jpg")
-                    ):
-                        logger.debug(f"caching image {self.id}")
-                        imageUri = self.thumbnails.get()[0].uri
-
-                        response = self.api.session.get(
-                            imageUri,
-                            headers={
-                                "content-length": None,
-                                "host": None,
-                            },
-                            stream=True,
-                        )
+        logger.debug(f"caching track {self.id}")
+        ytdl_options = dict(
+            ytdl_options,
+            outtmpl=cache_index.path(f"{self.id}.%(ext)s", create=True),
+            progress_hooks=[my_hook],
+        )
+
+        with youtube_dl.YoutubeDL(ytdl_options) as ydl:
+            if download_queue:
+                # which limits its speed while it is only prefetching
+                download_queue.throttle(self.id, ydl.params)
+            info = ydl.extract_info(
+                **ytdl_extract_info_options,
+                download=True,
+            )
 
-                        if response.status_code == 200:
-                            logger.debug(f"caching image {self.id}")
-                            magic = next(response.iter_content(4))
-                            if magic == b"\xff\xd8\xff\xe0":
-                                imageFile = f"{self.id}.jpg"
-                            elif magic == b"\x52\x49\x46\x46":
-                                imageFile = f"{self.id}.webp"
-                            else:
-                                logger.debug(
-                                    f"invlaid image format for {self.id}; magic: {magic}"
-                                )
-                                raise Exception(
-                                    f"Invalid image format for {self.id}; magic: {magic}"
-                                )
-
-                            with open(
-                                os.path.join(cache_location, imageFile),
-                                "wb",
-                            ) as out_file:
-                                out_file.write(magic)
-                                for chunk in response.iter_content():
-                                    out_file.write(chunk)
-                        del response
-
-                    # moved this here, because sometimes the metadata might go
-                    # missing, even if the audio and the image do not
-                    if f"{self.id}.json" not in os.listdir(cache_location):
-                        logger.debug(f"caching metadata {self.id}")
-                        with open(
-                            os.path.join(cache_location, f"{self.id}.json"), "w"
-                        ) as outfile:
-                            json.dump(
-                                convert_video_to_track(
-                                    self, bitrate=int(info.get("tbr", 0))
-                                ),
-                                cls=ModelJSONEncoder,
-                                fp=outfile,
-                            )
-                else:
-                    with youtube_dl.YoutubeDL(ytdl_options) as ydl:
-                        info = ydl.extract_info(
-                            **ytdl_extract_info_options,
-                            download=False,
-                        )
+            # get info about audio format, for debugging
+            logger.debug(
+                {
+                    "format_id": info["format_id"],
+                    "format_note": info["format_note"],
+                    "bitrate": info["abr"],
+                    "audio_ext": info["audio_ext"],
+                }
+            )
 
-                        self._audio_url.set(info["url"])
+        self._cache_extras(info)
 
+    def _cache_extras(self, info=None):
+        """
+        caches the thumbnail and the metadata of a cached track, unless they
+        are cached already
+        """
+        # moved this here, because sometimes the image might go
+        # missing, even if the audio and the json do not
+        if thumbnail_cache and not thumbnail_cache.find(self.id):
+            logger.debug(f"caching image {self.id}")
+            try:
+                thumbnail_cache.fetch(self)
             except Exception as e:
-                logger.error(f"audio_url error {e} (videoId: {self.id})")
-                self._audio_url.set(None)
-                return
+                logger.debug(f"could not cache image {self.id}: {e}")
+
+        # moved this here, because sometimes the metadata might go
+        # missing, even if the audio and the image do not
+        if not cache_index.find(self.id, ["json"]):
+            logger.debug(f"caching metadata {self.id}")
+            with open(cache_index.path(f"{self.id}.json", create=True), "w") as outfile:
+                json.dump(
+                    convert_video_to_track(
+                        self, bitrate=int((info or {}).get("tbr", 0))
+                    ),
+                    cls=ModelJSONEncoder,
+                    fp=outfile,
+                )
+            cache_index.add(f"{self.id}.json")
 
     @property
     def is_video(self):
         return True
 
 
+# the info of videos asked for at about the same time (eg by lookups of single
+# videos from several threads) is loaded together
+Video.info_batcher = workers.Batcher(Video._load_batch, size=50, window=0.05)
+Video.refresh_batcher = workers.Batcher(Video._refresh_batch, size=50, window=0.05)
+
+
 class Playlist(Entry):
+    kind = "playlist"
+
+    __slots__ = ("_videos",)
+
+    def __init__(self):
+        super().__init__()
+        self._videos = None
+
     @classmethod
     def load_info(cls, listOfPlaylists):
         """
@@ -596,6 +1175,7 @@ class Playlist(Entry):
         """
         minimum_fields = ["title", "video_count", "thumbnails", "channel"]
         listOfPlaylists = cls._add_futures(listOfPlaylists, minimum_fields)
+        listOfPlaylists = cls._load_stored_data(listOfPlaylists, minimum_fields)
 
         def job(sublist):
             item_dict = {}
@@ -609,21 +1189,51 @@ class Playlist(Entry):
 
             if data:
                 item_dict = {item["id"]: item for item in data["items"]}
-            for pl in sublist:
-                item_dict[pl.id], extended_fields = cls.extend_fields(
-                    item_dict.get(pl.id), minimum_fields
-                )
-                pl._set_api_data(extended_fields, item_dict.get(pl.id))
+            with stored_together():
+                for pl in sublist:
+                    item_dict[pl.id], extended_fields = cls.extend_fields(
+                        item_dict.get(pl.id), minimum_fields
+                    )
+                    pl._set_api_data(extended_fields, item_dict.get(pl.id))
 
-        with ThreadPoolExecutor() as executor:
-            # make sure order is deterministic so that HTTP requests are replayable in tests
-            executor.map(
-                job,
-                [
-                    listOfPlaylists[i : i + 50]
-                    for i in range(0, len(listOfPlaylists), 50)
-                ],
-            )
+        # make sure order is deterministic so that HTTP requests are replayable in tests
+        workers.map(
+            "load",
+            job,
+            [listOfPlaylists[i : i + 50] for i in range(0, len(listOfPlaylists), 50)],
+        )
+
+    @classmethod
+    def refresh(cls, listOfPlaylists, fields=()):
+        """
+        loads the info (and 'fields', if the api has them; the list of videos
+        if "videos" is one of them) of playlists again (see Entry.field_ttls),
+        replacing what is already known. If the playlists can't be loaded,
+        they keep their current info.
+        """
+        if "videos" in fields:
+            for pl in listOfPlaylists:
+                pl._load_videos(replace=True)
+            if len(fields) == 1:
+                return
+
+        minimum_fields = ["title", "video_count", "thumbnails", "channel"]
+        wanted = set(minimum_fields).union(fields)
+        for i in range(0, len(listOfPlaylists), 50):
+            sublist = listOfPlaylists[i : i + 50]
+            data = cls.api.list_playlists([x.id for x in sublist])
+            item_dict = {item["id"]: item for item in data["items"]}
+            with stored_together():
+                for pl in sublist:
+                    if pl.id not in item_dict:
+                        continue
+                    item, extended_fields = cls.extend_fields(
+                        item_dict[pl.id], minimum_fields
+                    )
+                    # only the fields that the api in use returns
+                    pl._set_api_data(
+                        [k for k in extended_fields if k in wanted], item, replace=True
+                    )
 
     @async_property
     def videos(self):
@@ -634,40 +1244,56 @@ class Playlist(Entry):
         """
         requiresVideos = self._add_futures([self], ["videos"])
 
-        def load_items():
-            data = {"items": []}
-            page = ""
-            while page is not None and len(data["items"]) < self.playlist_max_videos:
-                try:
-                    max_results = min(
-                        int(self.playlist_max_videos) - len(data["items"]), 50
-                    )
-                    result = self.api.list_playlistitems(self.id, page, max_results)
-                except Exception as e:
-                    logger.error('Playlist.videos list_playlistitems error "%s"', e)
-                    break
-                if "error" in result:
-                    logger.error(
-                        "error in list playlist items data for "
-                        "playlist {}, page {}".format(self.id, page),
-                    )
-                    break
-                page = result.get("nextPageToken") or None
-
-                # remove private and deleted videos from items
-                filtered_result = [
-                    item
-                    for item in result["items"]
-                    if not (
-                        item["snippet"]["title"] in ["Deleted video", "Private video"]
-                    )
-                ]
+        # the list of videos may be available from the metadata store
+        if requiresVideos and not self._load_stored_data([self], ["videos"]):
+            requiresVideos = False
+
+        if requiresVideos:
+            self._load_in_background("videos", self._load_videos)
+
+    def _load_videos(self, replace=False):
+        """
+        loads the list of videos of a playlist; if 'replace', replaces the
+        list that is already known, unless loading it fails
+        """
+        data = {"items": []}
+        page = ""
+        failed = False
+        while page is not None and len(data["items"]) < self.playlist_max_videos:
+            try:
+                max_results = min(
+                    int(self.playlist_max_videos) - len(data["items"]), 50
+                )
+                result = self.api.list_playlistitems(self.id, page, max_results)
+            except Exception as e:
+                logger.error('Playlist.videos list_playlistitems error "%s"', e)
+                failed = True
+                break
+            if "error" in result:
+                logger.error(
+                    "error in list playlist items data for "
+                    "playlist {}, page {}".format(self.id, page),
+                )
+                failed = True
+                break
+            page = result.get("nextPageToken") or None
+
+            # remove private and deleted videos from items
+            filtered_result = [
+                item
+                for item in result["items"]
+                if not (item["snippet"]["title"] in ["Deleted video", "Private video"])
+            ]
 
-                data["items"].extend(filtered_result)
+            data["items"].extend(filtered_result)
 
-            del data["items"][int(self.playlist_max_videos) :]
+        if replace and failed:
+            return
 
-            myvideos = []
+        del data["items"][int(self.playlist_max_videos) :]
+
+        myvideos = []
+        with stored_together():
             for item in data["items"]:
                 minimum_fields = ["title"]
                 item, extended_fields = self.extend_fields(item, minimum_fields)
@@ -677,20 +1303,27 @@ class Playlist(Entry):
                     video._set_api_data(extended_fields, item)
                     myvideos.append(video)
 
-            # start loading video info in the background
-            Video.load_info(
-                [x for _, x in zip(range(self.playlist_max_videos), myvideos)]
-            )
+        myvideos = [x for _, x in zip(range(self.playlist_max_videos), myvideos)]
 
-            self._videos.set(
-                [x for _, x in zip(range(self.playlist_max_videos), myvideos)]
-            )
+        # start loading video info in the background
+        Video.load_info(myvideos)
 
-        if requiresVideos:
-            executor = ThreadPoolExecutor(max_workers=1)
-            executor.submit(load_items)
-            executor.shutdown(wait=False)
-            # load_items()
+        self._set_field("videos", myvideos, replace=replace)
+
+        if metadata_store:
+            try:
+                metadata_store.save(
+                    self.kind, self.id, {"videos": [x.id for x in myvideos]}
+                )
+            except Exception as e:
+                logger.error(f"metadata store save error {e} ({self.id})")
+
+    def _set_stored_data(self, values):
+        # videos are stored as a list of ids
+        if "videos" in values:
+            ids, fetched_at = values["videos"]
+            values = dict(values, videos=([Video.get(id) for id in ids], fetched_at))
+        super()._set_stored_data(values)
 
     @async_property
     def video_count(self):
@@ -706,6 +1339,8 @@ class Playlist(Entry):
 
 
 class Channel(Entry):
+    __slots__ = ()
+
     @classmethod
     def playlists(cls, channel_id=None):
         """
@@ -726,14 +1361,16 @@ class Channel(Entry):
             return None
         try:
             channel_playlists = []
-            for item in data["items"]:
-                pl = Playlist.get(item["id"])
-                # this doesn't work. adding 'channel' here breaks something
-                # item, extended_fields = cls.extend_fields(item, minimum_fields)
-                extended_fields = minimum_fields
-                pl._set_api_data(extended_fields, item)
-                pl.videos  # should we start loading the videos here?
-                channel_playlists.append(pl)
+            with stored_together():
+                for item in data["items"]:
+                    pl = Playlist.get(item["id"])
+                    # this doesn't work. adding 'channel' here breaks something
+                    # item, extended_fields = cls.extend_fields(item, minimum_fields)
+                    extended_fields = minimum_fields
+                    pl._set_api_data(extended_fields, item)
+                    with workers.priority(workers.PREFETCH):
+                        pl.videos  # should we start loading the videos here?
+                    channel_playlists.append(pl)
             # Playlist.load_info(channel_playlists)  # what does this do, here?
             return channel_playlists
         except Exception as e:
@@ -36,6 +36,21 @@ def config(tmp_path):
         "youtube": {
             "enabled": True,
             "allow_cache": None,
+            "cache_max_size": None,
+            "cache_metadata": False,
+            "entry_cache_size": 4000,
+            "entry_cache_ttl": 21600,
+            "browse_cache_size": 4000,
+            "browse_cache_ttl": 21600,
+            "browse_cache_soft_ttl": 600,
+            "http_cache": False,
+            "http2": False,
+            "background_workers": 4,
+            "load_workers": 4,
+            "request_workers": 8,
+            "download_workers": 2,
+            "download_ratelimit": None,
+            "resolver_processes": 0,
             "youtube_api_key": None,
             "channel_id": None,
             "search_results": 15,
@@ -1,6 +1,10 @@
+import json
+from unittest import mock
+
 import pytest
 
 from mopidy_youtube import youtube
+from mopidy_youtube.apis import youtube_api
 
 from tests import apis, get_backend, my_vcr
 
@@ -107,3 +111,25 @@ def test_api_list_channelplaylists(api, config, headers):
         assert isinstance(channel_playlists, dict)
         assert isinstance(channel_playlists["items"], list)
         assert len(channel_playlists["items"]) > 0
+
+
+def test_api_conditional_requests():
+    youtube_api.API.etag_cache.clear()
+    data = {"items": [{"id": "e1YqueG2gtQ"}]}
+    modified = mock.Mock(status_code=200, ok=True, headers={"ETag": '"etag"'})
+    modified.text = json.dumps(data)
+    modified.json.return_value = data
+    not_modified = mock.Mock(status_code=304, ok=True, headers={})
+    session = mock.Mock()
+    session.get.side_effect = [modified, not_modified]
+    hits = youtube_api.API.etag_cache.hits
+
+    with mock.patch.object(youtube_api.API, "session", session, create=True):
+        assert youtube_api.API.list_videos(["e1YqueG2gtQ"]) == data
+        assert youtube_api.API.list_videos(["e1YqueG2gtQ"]) == data
+
+    assert session.get.call_args_list[0].kwargs["headers"] == {}
+    assert session.get.call_args_list[1].kwargs["headers"] == {
+        "If-None-Match": '"etag"'
+    }
+    assert youtube_api.API.etag_cache.hits == hits + 1
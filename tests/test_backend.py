@@ -1,3 +1,6 @@
+import time
+from unittest import mock
+
 import pytest
 from mopidy import backend as backend_api
 from mopidy.core import CoreListener as CoreListener_api
@@ -197,3 +200,35 @@ def test_backend_playback_translate_uri(
         audio_url = backend_inst.playback.translate_uri(video_uri)
         # How to test this?
         assert audio_url
+
+
+def test_backend_browse_cache_is_revalidated(config):
+    backend_inst = get_backend(config, {})
+    library = backend_inst.library
+    uri = "youtube:channel:root"
+    old = [Ref.playlist(uri="yt:playlist:PLold", name="old")]
+    new = [Ref.playlist(uri="yt:playlist:PLnew", name="new")]
+
+    with mock.patch.object(YouTubeLibraryProvider, "_browse", return_value=old):
+        assert library.browse(uri) == old
+        assert library.browse(uri) == old
+        assert library._browse.call_count == 1
+
+    with mock.patch.object(YouTubeLibraryProvider, "_browse", return_value=new):
+        # a stale listing is still returned, and checked in the background
+        refs, video_count, fetched_at = library.youtube_library_cache[uri]
+        library.youtube_library_cache[uri] = (refs, video_count, 0)
+        assert library.browse(uri) == old
+        for _ in range(100):
+            if not library.revalidating:
+                break
+            time.sleep(0.01)
+        assert library.browse(uri) == new
+
+        # explicit refresh
+        library.refresh(uri)
+        for _ in range(100):
+            if not library.revalidating:
+                break
+            time.sleep(0.01)
+        assert library._browse.call_count == 2
@@ -0,0 +1,75 @@
+import os
+
+from mopidy_youtube import cachedir
+
+
+def test_cache_index(tmp_path):
+    (tmp_path / "e1YqueG2gtQ.webm").write_bytes(b"audio")
+    (tmp_path / "e1YqueG2gtQ.json").write_text("{}")
+
+    index = cachedir.CacheIndex(tmp_path)
+    index.scan()
+
+    assert index.find("e1YqueG2gtQ", cachedir.audio_formats) == "e1YqueG2gtQ.webm"
+    assert index.find("e1YqueG2gtQ", ["json"]) == "e1YqueG2gtQ.json"
+    assert index.find("e1YqueG2gtQ", cachedir.image_formats) is None
+    assert index.find("nvlTJrNJ5lA", cachedir.audio_formats) is None
+
+    index.add(str(tmp_path / "e1YqueG2gtQ.jpg"))
+    assert index.find("e1YqueG2gtQ", cachedir.image_formats) == "e1YqueG2gtQ.jpg"
+
+    # variants of an image belong to the same id
+    index.add("e1YqueG2gtQ.small.jpg")
+    assert index.find("e1YqueG2gtQ", ["small.jpg"]) == "e1YqueG2gtQ.small.jpg"
+
+    index.discard("e1YqueG2gtQ.webm")
+    assert index.find("e1YqueG2gtQ", cachedir.audio_formats) is None
+    assert sorted(dict(index.entries())["e1YqueG2gtQ"]) == ["jpg", "json", "small.jpg"]
+
+
+def test_cache_index_evicts_least_recently_played(tmp_path):
+    for age, id in enumerate(["ccccccccccc", "bbbbbbbbbbb", "aaaaaaaaaaa"]):
+        for ext, size in [("webm", 100), ("json", 10)]:
+            path = tmp_path / f"{id}.{ext}"
+            path.write_bytes(b"x" * size)
+            os.utime(path, (1000 - age, 1000 - age))
+
+    index = cachedir.CacheIndex(tmp_path, max_size=250)
+    evicted = []
+    index.on_evict = evicted.append
+    index.protected = {"aaaaaaaaaaa"}
+    index.scan()
+    index.evict()
+
+    # aaaaaaaaaaa is older, but protected
+    assert evicted == ["bbbbbbbbbbb"]
+    assert not (tmp_path / "bb" / "bbbbbbbbbbb.webm").exists()
+    assert not (tmp_path / "bb" / "bbbbbbbbbbb.json").exists()
+    assert index.find("bbbbbbbbbbb", cachedir.audio_formats) is None
+    assert index.total_bytes == 220
+
+
+def test_cache_index_ignores_other_files(tmp_path):
+    (tmp_path / "metadata.sqlite3").write_bytes(b"x" * 1000)
+
+    index = cachedir.CacheIndex(tmp_path, max_size=10)
+    index.scan()
+
+    assert index.total_bytes == 0
+    assert index.evict() == []
+    assert (tmp_path / "metadata.sqlite3").exists()
+
+
+def test_cache_index_moves_flat_cache_into_shards(tmp_path):
+    (tmp_path / "e1YqueG2gtQ.webm").write_bytes(b"audio")
+    (tmp_path / "e1YqueG2gtQ.jpg").write_bytes(b"image")
+
+    index = cachedir.CacheIndex(tmp_path)
+    index.scan()
+
+    assert not (tmp_path / "e1YqueG2gtQ.webm").exists()
+    assert (tmp_path / "e1" / "e1YqueG2gtQ.webm").read_bytes() == b"audio"
+    assert index.path("e1YqueG2gtQ.jpg") == cachedir.shard_path(
+        str(tmp_path), "e1YqueG2gtQ.jpg"
+    )
+    assert index.find("e1YqueG2gtQ", cachedir.image_formats) == "e1YqueG2gtQ.jpg"
@@ -0,0 +1,33 @@
+from mopidy_youtube import cachestats
+
+
+def test_stats_ttl_cache():
+    now = [0]
+    cache = cachestats.StatsTTLCache("test", maxsize=2, ttl=100, timer=lambda: now[0])
+    assert cachestats.caches["test"] is cache
+
+    cache["a"] = 1
+    now[0] = 10
+    cache["b"] = 2
+
+    # "a" was added first, so it is evicted to make room for "c"
+    now[0] = 30
+    cache["c"] = 3
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+    # "b" and "c" expire
+    now[0] = 200
+    cache["d"] = 4
+
+    stats = cache.stats()
+    assert stats["size"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 2
+    assert stats["evicted_age_min"] == 30
+
+    cache.clear()
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from mopidy_youtube import comms
+
+
+def test_caching_session():
+    session = comms.CachingSession()
+    response = mock.Mock(status_code=200)
+
+    with mock.patch.object(
+        requests.Session, "request", return_value=response
+    ) as request:
+        url = "https://www.youtube.com/playlist?list=PL59FEE129ADFF2B12"
+        assert session.get(url) is response
+        assert session.get(url) is response
+        assert request.call_count == 1
+
+        # other params, other endpoints and bypassing the cache
+        session.get(url, params={"page": 2})
+        session.get("https://i.ytimg.com/vi/e1YqueG2gtQ/default.jpg")
+        session.get(url, cache=False)
+        with comms.fresh():
+            session.get(url)
+        assert request.call_count == 5
+
+        session.post(
+            "https://www.youtube.com/youtubei/v1/search", json={"query": "chvrches"}
+        )
+        session.post(
+            "https://www.youtube.com/youtubei/v1/search", json={"query": "chvrches"}
+        )
+        assert request.call_count == 6
+
+    assert session.cache.hits == 2
+
+
+def test_httpx_adapter():
+    httpx = pytest.importorskip("httpx")
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if request.url.path == "/flaky" and len(attempts) == 1:
+            return httpx.Response(502)
+        return httpx.Response(
+            200,
+            json={"path": request.url.path, "body": request.content.decode()},
+            headers={"ETag": "abc"},
+        )
+
+    session = requests.Session()
+    session.mount(
+        "https://",
+        comms.HTTPXAdapter(backoff_factor=0, transport=httpx.MockTransport(handler)),
+    )
+
+    response = session.get("https://www.youtube.com/flaky", params={"v": "x"})
+    assert response.status_code == 200
+    assert response.json() == {"path": "/flaky", "body": ""}
+    assert response.headers["etag"] == "abc"
+    assert len(attempts) == 2
+
+    response = session.post(
+        "https://www.youtube.com/youtubei/v1/search", json={"query": "chvrches"}
+    )
+    assert response.json()["body"] == '{"query": "chvrches"}'
+
+    with session.get("https://i.ytimg.com/vi/x/default.jpg", stream=True) as image:
+        assert b"".join(image.iter_content(4)) == image.content
+
+
+def test_http2_needs_h2():
+    # httpx without its http2 extra can't make HTTP/2 clients
+    with mock.patch.object(comms, "httpx", mock.Mock()), mock.patch.object(
+        comms, "h2", None
+    ):
+        assert not comms.http2_available()
+    with mock.patch.object(comms, "httpx", mock.Mock()), mock.patch.object(
+        comms, "h2", mock.Mock()
+    ):
+        assert comms.http2_available()
@@ -0,0 +1,151 @@
+import threading
+import time
+from unittest import mock
+
+from mopidy_youtube import downloads, workers
+
+
+class Downloader:
+    def __init__(self):
+        self.started = []
+        self.videos = {}
+        self.release = threading.Event()
+        self.condition = threading.Condition()
+
+    def __call__(self, id, videos=()):
+        with self.condition:
+            self.started.append(id)
+            self.videos[id] = list(videos)
+            self.condition.notify_all()
+        self.release.wait(5)
+
+    def wait_for(self, n):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.started) >= n, 5)
+
+
+def wait_until(predicate):
+    for _ in range(500):
+        if predicate():
+            return
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_download_queue(tmp_path):
+    download = Downloader()
+    state_file = tmp_path / "downloads.json"
+    queue = downloads.DownloadQueue(download, state_file=state_file, concurrency=1)
+    queue.save_delay = 0.1
+    write = mock.patch.object(queue, "_write", wraps=queue._write).start()
+
+    queue.put("a")
+    download.wait_for(1)
+    queue.put("b")
+    queue.put("c")
+    # moved up, ahead of the ones queued before it
+    queue.hurry("c", workers.INTERACTIVE)
+    queue.put("d", workers.INTERACTIVE)
+    # not queued, so not moved up (or queued)
+    queue.hurry("e")
+    assert queue.pending() == ["a", "c", "d", "b"]
+
+    # saved once, for all of those changes
+    wait_until(lambda: queue.saved() == ["a", "c", "d", "b"])
+    assert write.call_count == 1
+
+    # a download that was still under way when stopped stays saved, until
+    # it is done
+    queue.stop()
+    assert queue.saved() == ["a", "c", "d", "b"]
+    download.release.set()
+    wait_until(lambda: queue.saved() == ["c", "d", "b"])
+    assert download.started == ["a"]
+
+
+def test_download_queue_starts_playback_right_away():
+    download = Downloader()
+    queue = downloads.DownloadQueue(download, concurrency=2)
+
+    queue.put("a")
+    queue.put("b")
+    download.wait_for(2)
+    # not held up by the downloads that are under way
+    queue.put("playing", workers.PLAYBACK)
+    download.wait_for(3)
+    queue.put("c")
+    queue.put("d")
+    queue.hurry("d")
+    download.wait_for(4)
+    assert download.started[2:] == ["playing", "d"]
+    assert queue.pending()[4:] == ["c"]
+
+    download.release.set()
+    download.wait_for(5)
+    queue.stop()
+
+
+def test_download_queue_concurrency():
+    download = Downloader()
+    queue = downloads.DownloadQueue(download)
+    assert queue.concurrency == 2
+
+    for id in "abc":
+        queue.put(id)
+    download.wait_for(2)
+    assert sorted(download.started) == ["a", "b"]
+    assert queue.pending()[2:] == ["c"]
+
+    download.release.set()
+    download.wait_for(3)
+    queue.stop()
+    assert download.started[2] == "c"
+
+
+def test_download_queue_hands_over_the_videos_that_asked():
+    download = Downloader()
+    queue = downloads.DownloadQueue(download, concurrency=1)
+    first, second = object(), object()
+    queue.put("a")
+    download.wait_for(1)
+    queue.put("b", video=first)
+    queue.put("b", workers.INTERACTIVE, video=second)
+    queue.put("b", video=first)
+    # resumed from the state file, say, so not asked for by any video
+    queue.put("c")
+
+    download.release.set()
+    download.wait_for(3)
+    assert download.videos == {"a": [], "b": [first, second], "c": []}
+    queue.stop()
+
+
+def test_download_queue_ratelimit():
+    download = Downloader()
+    queue = downloads.DownloadQueue(download, concurrency=2, ratelimit=1000)
+    params = {}
+
+    def throttled(id, videos):
+        params[id] = {}
+        queue.throttle(id, params[id])
+        download(id, videos)
+
+    queue.download = throttled
+    queue.put("a")
+    queue.put("b", workers.INTERACTIVE)
+    download.wait_for(2)
+    # the slots are taken by throttled downloads, which share the limit
+    assert params["a"]["ratelimit"] == params["b"]["ratelimit"] == 500
+
+    # the track about to play doesn't wait for them, and isn't limited
+    queue.put("c", workers.PLAYBACK)
+    download.wait_for(3)
+    assert params["c"]["ratelimit"] is None
+
+    # moved up while under way, so no longer limited
+    queue.hurry("b")
+    assert params["b"]["ratelimit"] is None
+    assert params["a"]["ratelimit"] == 1000
+
+    download.release.set()
+    queue.stop()
@@ -20,6 +20,21 @@ def test_get_config_schema():
     schema = ext.get_config_schema()
 
     assert "allow_cache" in schema
+    assert "cache_max_size" in schema
+    assert "cache_metadata" in schema
+    assert "entry_cache_size" in schema
+    assert "entry_cache_ttl" in schema
+    assert "browse_cache_size" in schema
+    assert "browse_cache_ttl" in schema
+    assert "browse_cache_soft_ttl" in schema
+    assert "http_cache" in schema
+    assert "http2" in schema
+    assert "background_workers" in schema
+    assert "load_workers" in schema
+    assert "request_workers" in schema
+    assert "download_workers" in schema
+    assert "download_ratelimit" in schema
+    assert "resolver_processes" in schema
     assert "youtube_api_key" in schema
     assert "search_results" in schema
     assert "playlist_max_videos" in schema
@@ -0,0 +1,73 @@
+import os
+from unittest import mock
+
+import pytest
+
+from mopidy_youtube import resolver
+
+fake_youtube_dl = """
+import os
+
+
+class YoutubeDL:
+    def __init__(self, options):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download):
+        if url.endswith("private"):
+            raise Exception("ERROR: Private video")
+        return {
+            "url": f"https://example.com/videoplayback?pid={os.getpid()}",
+            "formats": [],
+        }
+"""
+
+
+def test_resolver(tmp_path, monkeypatch):
+    (tmp_path / "fake_youtube_dl.py").write_text(fake_youtube_dl)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    resolver.configure(1)
+    try:
+        url = resolver.resolve(
+            "fake_youtube_dl", {"proxy": None}, "https://www.youtube.com/watch?v=x"
+        )
+        # in another process, which sends back the url only
+        assert url.startswith("https://example.com/videoplayback?pid=")
+        assert not url.endswith(f"pid={os.getpid()}")
+        # nothing is left for shutdown to cancel
+        assert not resolver._futures
+
+        with pytest.raises(resolver.ResolveError, match="Private video"):
+            resolver.resolve(
+                "fake_youtube_dl", {}, "https://www.youtube.com/watch?v=private"
+            )
+    finally:
+        resolver.configure(0)
+
+
+def test_resolver_keeps_instances():
+    youtube_dl = mock.Mock()
+    youtube_dl.YoutubeDL.side_effect = lambda options: mock.MagicMock()
+    options = {"cachedir": "/tmp/youtube_dl", "proxy": None}
+
+    with resolver.instance(youtube_dl, options) as first:
+        # an instance is only lent to one caller at a time
+        with resolver.instance(youtube_dl, dict(options)) as second:
+            assert second is not first
+    with resolver.instance(youtube_dl, options) as again:
+        assert again in (first, second)
+    with resolver.instance(youtube_dl, {"cachedir": False}) as other:
+        assert other not in (first, second)
+    assert youtube_dl.YoutubeDL.call_count == 3
+
+    resolver.shutdown()
+    first.__exit__.assert_called_once()
+    with resolver.instance(youtube_dl, options):
+        assert youtube_dl.YoutubeDL.call_count == 4
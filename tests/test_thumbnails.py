@@ -0,0 +1,86 @@
+from unittest import mock
+
+import pytest
+from mopidy.models import Image
+
+from mopidy_youtube import thumbnails, workers, youtube
+from mopidy_youtube.cachedir import CacheIndex
+
+
+def response(status_code, content=b""):
+    resp = mock.MagicMock(status_code=status_code)
+    resp.__enter__.return_value = resp
+    resp.iter_content.return_value = iter([content[:4], content[4:]])
+    return resp
+
+
+def run_now(pool, fn, *args, **kwargs):
+    task = workers.Task(fn, args, {})
+    task.run()
+    return task
+
+
+def test_thumbnail_cache(tmp_path):
+    index = CacheIndex(tmp_path)
+    index.scan()
+    cache = thumbnails.ThumbnailCache(index)
+
+    video = youtube.Video.get("e1YqueG2gtQ")
+    video._set_field(
+        "thumbnails",
+        [
+            Image(uri="https://i.ytimg.com/small.jpg", width=120, height=90),
+            Image(uri="https://i.ytimg.com/maxresdefault.webp"),
+        ],
+    )
+    playlist = youtube.Playlist.get("PLvdVG7oER2eFutjd4xl3TGNDui9ELvY4D")
+    playlist._set_field(
+        "thumbnails", [Image(uri="https://i.ytimg.com/broken.jpg", width=120)]
+    )
+
+    responses = {
+        "https://i.ytimg.com/maxresdefault.webp": response(404),
+        "https://i.ytimg.com/small.jpg": response(200, b"\xff\xd8\xff\xe0jpeg"),
+        "https://i.ytimg.com/broken.jpg": response(200, b"<html>"),
+    }
+    with mock.patch.object(
+        cache.session, "get", side_effect=lambda uri, **kwargs: responses[uri]
+    ) as get, mock.patch.object(workers, "submit", side_effect=run_now) as submit:
+        cache.prefetch([video, playlist])
+
+        # the largest thumbnail is tried first
+        fetched = [call.args[0] for call in get.call_args_list]
+        assert fetched.index("https://i.ytimg.com/maxresdefault.webp") < fetched.index(
+            "https://i.ytimg.com/small.jpg"
+        )
+        assert cache.find(video.id) == f"{video.id}.jpg"
+        image = tmp_path / "e1" / f"{video.id}.jpg"
+        assert image.read_bytes() == b"\xff\xd8\xff\xe0jpeg"
+        assert cache.find(playlist.id) is None
+
+        # neither is fetched again
+        submit.reset_mock()
+        cache.prefetch([video, playlist])
+        submit.assert_not_called()
+
+
+def test_thumbnail_variants(tmp_path):
+    PIL = pytest.importorskip("PIL.Image")
+
+    PIL.new("RGB", (480, 360)).save(tmp_path / "e1YqueG2gtQ.jpg")
+    index = CacheIndex(tmp_path)
+    index.scan()
+    cache = thumbnails.ThumbnailCache(index)
+
+    assert cache.fetch(youtube.Video.get("e1YqueG2gtQ")) == "e1YqueG2gtQ.jpg"
+    assert cache.variants("e1YqueG2gtQ") == [
+        ("small", "e1YqueG2gtQ.small.jpg"),
+        ("medium", "e1YqueG2gtQ.medium.jpg"),
+    ]
+    with PIL.open(tmp_path / "e1" / "e1YqueG2gtQ.small.jpg") as small:
+        assert small.size == (120, 90)
+    assert [image.uri for image in cache.images("e1YqueG2gtQ")] == [
+        "/youtube/e1YqueG2gtQ.jpg",
+        "/youtube/e1YqueG2gtQ.medium.jpg",
+        "/youtube/e1YqueG2gtQ.small.jpg",
+    ]
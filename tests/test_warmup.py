@@ -0,0 +1,92 @@
+from unittest import mock
+
+from mopidy.internal import models, storage
+from mopidy.models import Ref, TlTrack, Track
+
+from mopidy_youtube import warmup, workers, youtube
+
+
+def test_warm_up_from_state_file(tmp_path):
+    uris = [
+        "yt:video:e1YqueG2gtQ",
+        "local:track:song.mp3",
+        "yt:video:h_uyq8oGDvU",
+        "youtube:video:LzDE2EsFVfk",
+    ]
+    state = models.CoreState(
+        tracklist=models.TracklistState(
+            tl_tracks=[
+                TlTrack(tlid=tlid, track=Track(uri=uri))
+                for tlid, uri in enumerate(uris, 1)
+            ],
+            next_tlid=5,
+        ),
+        history=models.HistoryState(
+            history=[
+                models.HistoryTrack(
+                    timestamp=1, track=Ref.track(uri="yt:video:7uj0hOIm2kY")
+                ),
+                models.HistoryTrack(
+                    timestamp=0, track=Ref.track(uri="yt:video:e1YqueG2gtQ")
+                ),
+            ]
+        ),
+        playback=models.PlaybackState(tlid=3, time_position=0, state="paused"),
+        mixer=models.MixerState(volume=50, mute=False),
+    )
+    storage.dump(tmp_path / "state.json.gz", {"version": "3.4.0", "state": state})
+
+    warm_up = warmup.WarmUp.from_state_file(tmp_path / "state.json.gz")
+
+    # the current track first
+    assert warm_up.tracklist_ids == ["h_uyq8oGDvU", "LzDE2EsFVfk", "e1YqueG2gtQ"]
+    assert warm_up.history_ids == ["7uj0hOIm2kY"]
+    assert warmup.WarmUp.from_state_file(tmp_path / "missing.json.gz") is None
+
+
+def test_warm_up(youtube_dl_mock):
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    youtube.cache_location = None
+    youtube.Video.proxy = None
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_videos.side_effect = lambda ids: {
+        "items": [
+            {
+                "id": id,
+                "snippet": {"title": id, "channelTitle": "a channel"},
+                "contentDetails": {"duration": "PT1M"},
+            }
+            for id in ids
+        ]
+    }
+    ydl = youtube_dl_mock.YoutubeDL.return_value.__enter__.return_value
+    priorities = []
+
+    def extract_info(**kwargs):
+        priorities.append(workers.current_priority())
+        return {"url": "https://example.com/videoplayback"}
+
+    ydl.extract_info.side_effect = extract_info
+
+    warm_up = warmup.WarmUp(
+        [f"video{i:06}" for i in range(10)], ["video000001", "played00000"]
+    )
+    warm_up.interval = 0
+    warm_up.start()
+    assert warmup.active is warm_up
+    assert warm_up.covers("video000009")
+    assert warm_up.done.wait(5)
+
+    assert warmup.active is None
+    assert not warm_up.covers("video000009")
+    # the current and next tracks first, then the rest, then the history
+    requested = [c.args[0] for c in youtube.Entry.api.list_videos.call_args_list]
+    assert requested == [
+        [f"video{i:06}" for i in range(4)],
+        [f"video{i:06}" for i in range(4, 10)],
+        ["played00000"],
+    ]
+    assert ydl.extract_info.call_count == 10
+    # and only the current and next tracks ahead of other work
+    assert priorities == [workers.INTERACTIVE] * 4 + [workers.PREFETCH] * 6
@@ -0,0 +1,142 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from mopidy_youtube import comms, workers
+
+
+def test_workers_map():
+    workers.configure(load=2, requests=2)
+    threads = set()
+
+    def request(i):
+        threads.add(threading.current_thread().name)
+        return i * 2
+
+    def load(batch):
+        # waits for the "requests" pool, and runs work for its own pool inline
+        inner = list(workers.map("load", lambda i: i, batch))
+        return list(workers.map("requests", request, inner))
+
+    assert list(workers.map("load", load, [[1, 2], [3], [4, 5]])) == [
+        [2, 4],
+        [6],
+        [8, 10],
+    ]
+    # by the workers, or by the callers that were waiting for them
+    assert threads <= {"YouTubeRequests-0", "YouTubeRequests-1"} | {
+        "YouTubeLoad-0",
+        "YouTubeLoad-1",
+        threading.current_thread().name,
+    }
+
+    def fail(i):
+        raise ValueError(i)
+
+    results = workers.map("requests", fail, [1])
+    with pytest.raises(ValueError):
+        next(results)
+
+    workers.shutdown()
+
+
+def test_workers_keep_fresh():
+    with comms.fresh():
+        assert list(workers.map("requests", lambda _: comms.is_fresh(), [0])) == [True]
+        assert workers.submit("background", comms.is_fresh).result() is True
+    assert list(workers.map("requests", lambda _: comms.is_fresh(), [0])) == [False]
+
+    workers.shutdown()
+
+
+def wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_workers_priorities():
+    started = []
+    release = threading.Event()
+
+    def job(name):
+        started.append(name)
+        release.wait(5)
+
+    def put(pool, name, level):
+        task = workers.Task(job, (name,), {}, level)
+        pool.put(task)
+        return task
+
+    # queued tasks run in order of priority
+    pool = workers.Pool("test", 1)
+    tasks = [put(pool, "busy", workers.INTERACTIVE)]
+    assert wait_until(lambda: started == ["busy"])
+    tasks += [
+        put(pool, "prefetch", workers.PREFETCH),
+        put(pool, "interactive", workers.INTERACTIVE),
+        put(pool, "playback", workers.PLAYBACK),
+    ]
+    release.set()
+    for task in tasks:
+        task.result(5)
+    assert started == ["busy", "playback", "interactive", "prefetch"]
+    pool.shutdown()
+
+    # prefetching takes up no more than half of the threads
+    started.clear()
+    release.clear()
+    pool = workers.Pool("test", 2)
+    prefetches = [put(pool, f"prefetch{i}", workers.PREFETCH) for i in range(2)]
+    assert wait_until(lambda: started == ["prefetch0"])
+    interactive = put(pool, "interactive", workers.INTERACTIVE)
+    assert wait_until(lambda: started == ["prefetch0", "interactive"])
+
+    # a queued task that is waited for is run by the waiting thread
+    release.set()
+    prefetches[1].steal()
+    assert started == ["prefetch0", "interactive", "prefetch1"]
+    interactive.result(5)
+    prefetches[0].result(5)
+    pool.shutdown()
+
+
+def test_workers_operations():
+    started = []
+    release = threading.Event()
+
+    def job(name):
+        started.append(name)
+        release.wait(5)
+
+    pool = workers.Pool("test", 1)
+    with mock.patch.object(workers, "pool", return_value=pool):
+        busy = workers.submit("test", job, "busy")
+        assert wait_until(lambda: started == ["busy"])
+
+        with workers.operation("search"):
+            old = workers.submit("test", job, "old")
+            with workers.operation():
+                # work of an operation started in another one is dropped too
+                nested = workers.submit("test", job, "nested")
+            waited = workers.Task(job, ("waited",), {})
+            waited.droppable = False
+            pool.put(waited)
+        with workers.operation("browse"):
+            other = workers.submit("test", job, "other")
+        with workers.operation("search"):
+            new = workers.submit("test", job, "new")
+        with workers.operation(timeout=0.01):
+            late = workers.submit("test", job, "late")
+        time.sleep(0.02)
+
+        release.set()
+        for task in (busy, waited, other, new):
+            task.result(5)
+        assert old.cancelled() and nested.cancelled() and late.cancelled()
+        assert started == ["busy", "waited", "other", "new"]
+    pool.shutdown()
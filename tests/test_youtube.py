@@ -1,6 +1,12 @@
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+import pykka
 import pytest
 
-from mopidy_youtube import youtube
+from mopidy_youtube import cachestats, storage, workers, youtube
 
 from tests import apis, my_vcr
 from tests.test_api import setup_entry_api
@@ -141,3 +147,400 @@ def test_youtube_channel_playlists(api, config, headers):
 
         assert isinstance(channel_playlists, list)
         assert len(channel_playlists) > 0
+
+
+def test_metadata_store(tmp_path):
+    youtube.Entry.cache.clear()
+    youtube.metadata_store = storage.MetadataStore(tmp_path / "metadata.sqlite3")
+    try:
+        youtube.Entry.api = mock.Mock()
+        youtube.Entry.api.list_videos.return_value = {
+            "items": [
+                {
+                    "id": "e1YqueG2gtQ",
+                    "snippet": {"title": "a title", "channelTitle": "a channel"},
+                    "contentDetails": {"duration": "PT3M20S"},
+                }
+            ]
+        }
+        assert youtube.Video.get("e1YqueG2gtQ").title.get() == "a title"
+
+        # after a "restart", the metadata is loaded without calling the API
+        youtube.Entry.cache.clear()
+        youtube.Entry.api.list_videos.side_effect = Exception("no network")
+        video = youtube.Video.get("e1YqueG2gtQ")
+        assert video.title.get() == "a title"
+        assert video.channel.get() == "a channel"
+        assert video.length.get() == 200
+        assert youtube.Entry.api.list_videos.call_count == 1
+    finally:
+        youtube.metadata_store.close()
+        youtube.metadata_store = None
+
+
+def test_metadata_store_saves_batches_together(tmp_path):
+    store = storage.MetadataStore(tmp_path / "metadata.sqlite3")
+    try:
+        with mock.patch.object(store, "_write", wraps=store._write) as write:
+            with store.batch():
+                store.save("video", "aaaaaaaaaaa", {"title": "a"})
+                with store.batch():
+                    store.save("video", "bbbbbbbbbbb", {"title": "b"})
+                assert store.load("video", ["aaaaaaaaaaa"]) == {}
+            # in one transaction, once the outermost batch is done
+            write.assert_called_once()
+        assert set(store.load("video", ["aaaaaaaaaaa", "bbbbbbbbbbb"])) == {
+            "aaaaaaaaaaa",
+            "bbbbbbbbbbb",
+        }
+    finally:
+        store.close()
+
+
+def test_dead_video_is_not_looked_up_again():
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_videos.return_value = {"items": []}
+
+    assert youtube.Video.get("deadvideo01").title.get() == "Video unplayable"
+    assert youtube.Video.dead_reason("deadvideo01")
+
+    youtube.Entry.cache.clear()
+    video = youtube.Video.get("deadvideo01")
+    assert video.title.get() == "Video unplayable"
+    assert video.audio_url.get() is None
+    assert youtube.Entry.api.list_videos.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "error,dead",
+    [
+        ("ERROR: Private video. Sign in if you've been granted access", True),
+        ("ERROR: This video has been removed by the uploader", True),
+        (
+            "ERROR: Video unavailable. This video contains content from SME, "
+            "who has blocked it on copyright grounds",
+            True,
+        ),
+        # what yt-dlp says while it is rate limited
+        (
+            "ERROR: Video unavailable. This content isn't available, try again "
+            "later",
+            False,
+        ),
+    ],
+)
+def test_only_permanent_errors_mark_videos_dead(youtube_dl_mock, error, dead):
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    youtube.Video.proxy = None
+    ydl = youtube_dl_mock.YoutubeDL.return_value.__enter__.return_value
+    ydl.extract_info.side_effect = Exception(error)
+
+    assert youtube.Video.get("e1YqueG2gtQ").audio_url.get() is None
+    assert bool(youtube.Video.dead_reason("e1YqueG2gtQ")) is dead
+
+
+def test_concurrent_lookups_are_batched():
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_videos.side_effect = lambda ids: {
+        "items": [
+            {
+                "id": id,
+                "snippet": {"title": f"title of {id}", "channelTitle": "a channel"},
+                "contentDetails": {"duration": "PT1M"},
+            }
+            for id in ids
+        ]
+    }
+    ids = [f"video{i:06}" for i in range(120)]
+
+    # every video is looked up twice, each time from a thread of its own
+    threads = [
+        threading.Thread(target=lambda id=id: youtube.Video.get(id).title.get())
+        for id in ids + ids
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert youtube.Video.get("video000042").title.get() == "title of video000042"
+    listed = [
+        id for call in youtube.Entry.api.list_videos.call_args_list for id in call[0][0]
+    ]
+    assert sorted(listed) == ids
+    assert youtube.Entry.api.list_videos.call_count <= 4
+
+
+def test_search_cache():
+    youtube.Entry.cache.clear()
+    youtube.Entry.search_cache.clear()
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.search.return_value = {
+        "items": [
+            {
+                "id": {"kind": "youtube#video", "videoId": "e1YqueG2gtQ"},
+                "snippet": {"title": "a title", "channelTitle": "a channel"},
+            }
+        ]
+    }
+    hits = youtube.Entry.search_cache.hits
+
+    first = youtube.Entry.search("Test  query")
+    second = youtube.Entry.search("test query")
+
+    assert second == first
+    assert youtube.Entry.api.search.call_count == 1
+    assert youtube.Entry.search_cache.hits == hits + 1
+
+    # entries dropped from Entry.cache mean searching again
+    youtube.Entry.cache.clear()
+    youtube.Entry.search("test query")
+    assert youtube.Entry.api.search.call_count == 2
+    assert youtube.Entry.search_cache.hits == hits + 1
+    # reported along with the other caches
+    assert cachestats.caches["searches"] is youtube.Entry.search_cache
+
+
+def test_audio_url_is_resolved_again_when_expiring(youtube_dl_mock):
+    youtube.Entry.cache.clear()
+    youtube.Video.proxy = None
+    ydl = youtube_dl_mock.YoutubeDL.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {
+        "url": f"https://example.com/videoplayback?expire={int(time.time()) + 60}"
+    }
+
+    video = youtube.Video.get("e1YqueG2gtQ")
+    assert video.audio_url.get()
+    assert video.audio_url_stale()
+
+    url = f"https://example.com/videoplayback?expire={int(time.time()) + 21600}"
+    ydl.extract_info.return_value = {"url": url}
+    assert video.refresh_audio_url().get() == url
+    assert not video.audio_url_stale()
+
+    # a fresh url is not resolved again
+    assert video.refresh_audio_url().get() == url
+    assert ydl.extract_info.call_count == 2
+
+
+def test_stale_field_is_loaded_again_in_the_background():
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_videos.return_value = {
+        "items": [
+            {
+                "id": "e1YqueG2gtQ",
+                "snippet": {"title": "new title", "channelTitle": "a channel"},
+                "contentDetails": {"duration": "PT1M"},
+            }
+        ]
+    }
+
+    video = youtube.Video.get("e1YqueG2gtQ")
+    week_ago = time.time() - youtube.Entry.field_ttls["title"] - 1
+    video._set_field("title", "old title", fetched_at=week_ago)
+    old = video.title
+
+    # the stale value is returned straight away
+    assert old.get() == "old title"
+    for _ in range(100):
+        if video.title is not old:
+            break
+        time.sleep(0.01)
+
+    assert video.title.get() == "new title"
+    assert old.get() == "old title"
+    assert youtube.Entry.api.list_videos.call_count == 1
+
+    # and, now that it is fresh, not loaded again
+    video.title
+    assert youtube.Entry.api.list_videos.call_count == 1
+
+
+def test_stale_fields_are_loaded_again_together():
+    youtube.Entry.cache.clear()
+    youtube.Video.dead_cache.clear()
+    ids = [f"video{i:06}" for i in range(3)]
+    youtube.Entry.api = mock.Mock()
+    # as the Data API returns them: no album, artists or track_no
+    youtube.Entry.api.list_videos.side_effect = lambda ids: {
+        "items": [
+            {
+                "id": id,
+                "snippet": {"title": f"new title of {id}", "channelTitle": "a"},
+                "contentDetails": {"duration": "PT1M"},
+            }
+            for id in ids
+        ]
+    }
+
+    videos = [youtube.Video.get(id) for id in ids]
+    week_ago = time.time() - youtube.Entry.field_ttls["title"] - 1
+    for video in videos:
+        video._set_field("title", "old title", fetched_at=week_ago)
+        video._set_field("album", {"name": "an album"}, fetched_at=week_ago)
+    with mock.patch.object(youtube.logger, "error") as error:
+        for video in videos:
+            video.title
+            video.album
+        for _ in range(100):
+            if all(video.title.get() != "old title" for video in videos):
+                break
+            time.sleep(0.01)
+
+    assert [video.title.get() for video in videos] == [
+        f"new title of {id}" for id in ids
+    ]
+    # in one request, which didn't have the albums to replace
+    assert youtube.Entry.api.list_videos.call_count == 1
+    assert videos[0].album.get() == {"name": "an album"}
+    error.assert_not_called()
+
+
+def test_dropped_load_is_done_when_asked_for(config):
+    youtube.Entry.cache.clear()
+    youtube.Playlist.playlist_max_videos = config["youtube"]["playlist_max_videos"]
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_playlistitems.return_value = {
+        "items": [
+            {
+                "snippet": {
+                    "title": "a video",
+                    "resourceId": {"videoId": "e1YqueG2gtQ"},
+                }
+            }
+        ]
+    }
+    release = threading.Event()
+    pool = workers.Pool("test", 1)
+
+    with mock.patch.object(workers, "pool", return_value=pool):
+        busy = workers.submit("background", release.wait, 5)
+        with workers.operation("search"):
+            playlist = youtube.Playlist.get("PLvdVG7oER2eFutjd4xl3TGNDui9ELvY4D")
+            playlist.videos  # start loading
+        with workers.operation("search"):
+            pass
+        release.set()
+        busy.result(5)
+        pool.shutdown()
+
+        # dropped, so unset, to be loaded by whoever asks for it
+        for _ in range(100):
+            if playlist._videos is None:
+                break
+            time.sleep(0.01)
+        assert youtube.Entry.api.list_playlistitems.call_count == 0
+        videos = playlist.videos.get(timeout=5)
+        assert [video.id for video in videos] == ["e1YqueG2gtQ"]
+        assert youtube.Entry.api.list_playlistitems.call_count == 1
+
+
+def test_dropped_load_is_done_for_a_field_taken_before(config):
+    youtube.Entry.cache.clear()
+    youtube.Playlist.playlist_max_videos = config["youtube"]["playlist_max_videos"]
+    youtube.Entry.api = mock.Mock()
+    youtube.Entry.api.list_playlistitems.return_value = {
+        "items": [
+            {
+                "snippet": {
+                    "title": "a video",
+                    "resourceId": {"videoId": "e1YqueG2gtQ"},
+                }
+            }
+        ]
+    }
+    release = threading.Event()
+    pool = workers.Pool("test", 1)
+
+    with mock.patch.object(workers, "pool", return_value=pool):
+        busy = workers.submit("background", release.wait, 5)
+        with workers.operation("search"):
+            playlist = youtube.Playlist.get("PLvdVG7oER2eFutjd4xl3TGNDui9ELvY4D")
+            field = playlist.videos  # start loading
+        with workers.operation("search"):
+            pass
+        release.set()
+        busy.result(5)
+        pool.shutdown()
+
+        # dropped, and its loader forgotten, while the field is still held
+        for _ in range(100):
+            if playlist._videos is None and field not in youtube.Field.loaders:
+                break
+            time.sleep(0.01)
+        assert youtube.Entry.api.list_playlistitems.call_count == 0
+        videos = field.get(timeout=5)
+        assert [video.id for video in videos] == ["e1YqueG2gtQ"]
+        assert youtube.Entry.api.list_playlistitems.call_count == 1
+
+
+def test_download_sets_the_videos_that_asked_for_it():
+    video_id = "e1YqueG2gtQ"
+    youtube.Entry.cache.clear()
+    evicted = youtube.Video.get(video_id)
+    evicted._add_futures([evicted], ["audio_url"])
+    youtube.Entry.cache.clear()
+    video = youtube.Video.get(video_id)
+    video._add_futures([video], ["audio_url"])
+    assert video is not evicted
+
+    cache_index = mock.Mock()
+    cache_index.find.return_value = f"{video_id}.webm"
+    cache_index.path.return_value = f"/cache/{video_id}.webm"
+    with mock.patch.object(youtube, "cache_index", cache_index):
+        youtube.Video.download(video_id, [evicted, video])
+
+    # both, although only 'video' can still be looked up by its id
+    assert evicted.audio_url.get(timeout=1) == f"file:///cache/{video_id}.webm"
+    assert video.audio_url.get(timeout=1) == f"file:///cache/{video_id}.webm"
+
+
+def test_compact_entry_memory():
+    """
+    benchmark: memory used per cached video with its basic fields loaded,
+    compared to keeping a pykka.ThreadingFuture per field in the instance
+    __dict__, as Entry used to
+    """
+
+    class LegacyVideo:
+        pass
+
+    fields = ["title", "channel", "channelId", "length", "thumbnails", "artists"]
+
+    def legacy(i):
+        video = LegacyVideo()
+        video.id = f"video{i:06}"
+        for k in fields:
+            future = video.__dict__["_" + k] = pykka.ThreadingFuture()
+            future.set("value")
+        return video
+
+    def compact(i):
+        video = youtube.Video()
+        video.id = f"video{i:06}"
+        for k in fields:
+            video._set_field(k, "value")
+        return video
+
+    def bytes_per_video(create):
+        tracemalloc.start()
+        videos = [create(i) for i in range(1000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(videos) == 1000
+        return size / 1000
+
+    legacy_size = bytes_per_video(legacy)
+    compact_size = bytes_per_video(compact)
+
+    # about 25kB legacy, under 1kB compact
+    assert compact_size < legacy_size / 4
+    assert compact_size < 1500
+    assert compact(0).title.get() == "value"